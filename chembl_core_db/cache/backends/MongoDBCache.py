@@ -2,19 +2,41 @@
 # Author Karol Sikora <karol.sikora@laboratorium.ee>, (c) 2012
 # Author Michal Nowotka <mmmnow@gmail.com>, (c) 2013-2014
 
-import traceback
+import os
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 import base64
 import pymongo
-from bson import Binary
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, PyMongoError
+from bson import Binary, ObjectId
+from pymongo.read_preferences import Nearest, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+import calendar
+import functools
 import re
+import threading
+from contextlib import contextmanager
+import time
 from datetime import datetime, timedelta
-from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils import six
+from django.utils.module_loading import import_string
 import zlib
 import logging
+from chembl_core_db.cache.backends.circuitBreaker import get_circuit_breaker
+from chembl_core_db.cache.backends.clientRegistry import bootstrap_once, get_client
+from chembl_core_db.cache.backends.compressionStats import get_compression_stats
+from chembl_core_db.cache.backends.hashedKeys import HashedKey, hash_key
+from chembl_core_db.cache.backends.hedgedReads import get_hedged_reader
+from chembl_core_db.cache.backends.nearCache import get_near_cache
+from chembl_core_db.cache.backends.processLocal import PeriodicTask, get_shared
+from chembl_core_db.cache.backends.refresher import get_refresher
+from chembl_core_db.cache.backends.resourcePolicies import get_resource_policies
+from chembl_core_db.cache.backends.serializers import Pipeline, get_codec, get_serializer
+from chembl_core_db.cache.backends.writeBuffer import get_write_buffer
 try:
     from urllib import urlencode
 except ImportError:
@@ -24,6 +46,22 @@ except ImportError:
 # ----------------------------------------------------------------------------------------------------------------------
 
 MAX_SIZE = 16000000
+SIZE_BUCKETS = [0, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, MAX_SIZE]
+MIN_INT64 = -2 ** 63
+MAX_INT64 = 2 ** 63 - 1
+CHUNK_SIZE = MAX_SIZE
+LEASE_SUFFIX = ':lease'
+DELETE_BATCH_SIZE = 1000
+
+_MISSING = object()
+
+# read preferences accepting TAG_SETS
+READ_PREFERENCES = {
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
 
 
 def camel_case_to_snake_case(name):
@@ -32,6 +70,91 @@ def camel_case_to_snake_case(name):
 # ----------------------------------------------------------------------------------------------------------------------
 
 
+def _argument(args, kwargs, index, name, default=None):
+    if len(args) > index:
+        return args[index]
+    return kwargs.get(name, default)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _GuardState(threading.local):
+    # the guarded call running in the current thread, if any
+    active = False
+    failed = False
+
+
+class CacheUnavailable(PyMongoError):
+    # raised without calling Mongo while the circuit breaker is open, by the methods that have no fallback result
+    pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def guarded(fallback=None):
+    # routes a cache method through the circuit breaker and the latency budget; `fallback(args, kwargs)` gives the
+    # result when Mongo is unavailable or the call fails, methods without one raise the error instead
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.breaker is None:
+                with self._latency_budget():
+                    return method(self, *args, **kwargs)
+            guard = self._guard
+            if guard.active:
+                # get and set called by get_or_set run under the permit of the outer call, which reports the outcome;
+                # asking the breaker again would refuse them while the outer call is the half-open probe
+                try:
+                    return method(self, *args, **kwargs)
+                except PyMongoError:
+                    guard.failed = True
+                    self.log.warning('Cache call {0} failed'.format(method.__name__), exc_info=True)
+                    if fallback is None:
+                        raise
+                    return fallback(args, kwargs)
+            if not self.breaker.allow():
+                if fallback is None:
+                    raise CacheUnavailable('Circuit breaker of cache {0} is open'.format(self.breaker.name))
+                return fallback(args, kwargs)
+            guard.active = True
+            guard.failed = False
+            start = time.time()
+            try:
+                with self._latency_budget():
+                    result = method(self, *args, **kwargs)
+            except PyMongoError:
+                self.breaker.record_failure()
+                self.log.warning('Cache call {0} failed'.format(method.__name__), exc_info=True)
+                if fallback is None:
+                    raise
+                return fallback(args, kwargs)
+            except Exception:
+                if guard.failed:
+                    # e.g. incr raising ValueError because the get it made failed
+                    self.breaker.record_failure()
+                else:
+                    # not a Mongo failure (e.g. the callable of get_or_set raised), it tells nothing about the server
+                    self.breaker.release()
+                raise
+            finally:
+                guard.active = False
+            if guard.failed or self._latency_budget_ms and (time.time() - start) * 1000 > self._latency_budget_ms:
+                # too slow counts as failed even when it succeeded
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return result
+        return wrapper
+    return decorator
+
+
+def _call_default(args, kwargs):
+    default = _argument(args, kwargs, 1, 'default')
+    return default() if callable(default) else default
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
 class MongoDBCache(BaseCache):
 
     def __init__(self, location, params):
@@ -50,28 +173,116 @@ class MongoDBCache(BaseCache):
         self._socket_timeout_ms = options.get('SOCKET_TIMEOUT_MS', None)
         self._connect_timeout_ms = options.get('CONNECT_TIMEOUT_MS', 20000)
         self._max_time_ms = options.get('MAX_TIME_MS', 2000)
-        self._compression = options.get('COMPRESSION', True)
-        self.compression_level = options.get('COMPRESSION_LEVEL', 0)
+        self._max_pool_size = options.get('MAX_POOL_SIZE', None)
+        self._min_pool_size = options.get('MIN_POOL_SIZE', None)
+        self._wait_queue_timeout_ms = options.get('WAIT_QUEUE_TIMEOUT_MS', None)
+        self._codec = options.get('CODEC', 'zlib' if options.get('COMPRESSION', True) else 'none')
+        self._compression = self._codec != 'none'
+        self.compression_level = options.get('COMPRESSION_LEVEL')
+        self._serializer = options.get('SERIALIZER', 'pickle')
+        # small values and values that barely shrink (PNG/SVG images) are stored uncompressed
+        self._pipeline = Pipeline(get_serializer(self._serializer), get_codec(self._codec, self.compression_level),
+                                  options.get('COMPRESSION_MIN_SIZE', 512), options.get('COMPRESSION_SAMPLE_SIZE', 4096),
+                                  options.get('COMPRESSION_MAX_RATIO', 0.9))
         self._tag_sets = options.get('TAG_SETS', None)
         self._read_preference = options.get("READ_PREFERENCE")
+        if self._tag_sets and self._read_preference in READ_PREFERENCES:
+            self._read_preference = READ_PREFERENCES[self._read_preference](tag_sets=self._tag_sets)
         self._collection_indexes = options.get('INDEXES', None)
+        # long keys (full API URLs) are stored under a fixed-width digest, with the key itself in a side field
+        self._hash_keys = options.get('HASH_KEYS', False)
+        self._hash_algorithm = options.get('HASH_ALGORITHM', 'sha1')
+        # while switching HASH_KEYS on, entries stored under their full key are still read and deleted
+        self._hash_keys_migration = options.get('HASH_KEYS_MIGRATION', False)
+        # in-memory stand-in for Mongo (requires mongomock), meant for tests and local development
+        self._mock = options.get('MOCK', False)
+        self._patch_gevent = options.get('PATCH_GEVENT', False)
+        # culling is opt-in, BaseCache defaults MAX_ENTRIES to 300 which is far too low for this backend
+        self._cull_enabled = 'MAX_ENTRIES' in options or 'max_entries' in params
+        self._cull_batch_size = options.get('CULL_BATCH_SIZE', 1000)
+        self._cull_interval = options.get('CULL_INTERVAL', 60)
+        self._cull_pause = options.get('CULL_PAUSE', 0.1)
+        self._quota_batch_size = options.get('QUOTA_BATCH_SIZE', 100)
+        # pause between eviction batches, so quota enforcement never saturates the server
+        self._quota_pause = options.get('QUOTA_PAUSE', 0.1)
         self._collection = location
+        self._near_cache_max_bytes = options.get('NEAR_CACHE_MAX_BYTES', 0)
+        self._near_cache_timeout = options.get('NEAR_CACHE_TIMEOUT', 5)
+        self._near_cache_invalidate = options.get('NEAR_CACHE_INVALIDATE', True)
+        self._lease_timeout = options.get('LEASE_TIMEOUT', 30)
+        self._lease_wait = options.get('LEASE_WAIT', 5)
+        self._lease_poll_interval = options.get('LEASE_POLL_INTERVAL', 0.05)
+        self._lease_serve_stale = options.get('LEASE_SERVE_STALE', True)
+        # seconds an entry may still be served after its timeout while it is refreshed in the background
+        self._stale_grace = options.get('STALE_WHILE_REVALIDATE', 0)
+        self._refresh_callback = options.get('REFRESH_CALLBACK', None)
+        if self._refresh_callback and not callable(self._refresh_callback):
+            self._refresh_callback = import_string(self._refresh_callback)
+        # name of this cache within the process, used to share helpers between per-thread backend instances
+        process_name = '{0}/{1}/{2}'.format(self._host, self._database, location)
+        self.refresher = None
+        if self._stale_grace:
+            self.refresher = get_refresher(process_name, options.get('REFRESH_WORKERS', 2),
+                                           options.get('REFRESH_QUEUE_SIZE', 100))
+        self.codec_stats = get_compression_stats(process_name)
+        self.culler = None
+        if self._cull_enabled:
+            # one culling thread per process, requests never wait for it
+            self.culler = get_shared('culler', process_name, lambda: PeriodicTask('cache-cull', self._cull_interval))
+        self.policies = None
+        if options.get('RESOURCE_POLICIES'):
+            self.policies = get_resource_policies(process_name, options['RESOURCE_POLICIES'],
+                                                  options.get('QUOTA_INTERVAL', 60))
+        # access times are only maintained when something evicts by them
+        self._track_access = self._cull_enabled or bool(self.policies and self.policies.quotas)
+        self.near_cache = None
+        if self._near_cache_max_bytes:
+            self.near_cache = get_near_cache(process_name, self._near_cache_max_bytes, self._near_cache_timeout)
+        self.breaker = None
+        self._guard = _GuardState()
+        if options.get('CIRCUIT_BREAKER', False):
+            self.breaker = get_circuit_breaker(process_name, options.get('CIRCUIT_FAILURE_THRESHOLD', 5),
+                                               options.get('CIRCUIT_WINDOW', 10),
+                                               options.get('CIRCUIT_RESET_TIMEOUT', 5))
+        # per call deadline, slower calls count as failures for the circuit breaker; independent of MAX_TIME_MS
+        self._latency_budget_ms = options.get('LATENCY_BUDGET_MS', None)
+        self.hedged_reader = None
+        if options.get('HEDGED_READS', False):
+            self.hedged_reader = get_hedged_reader(process_name, options.get('HEDGE_PERCENTILE', 95),
+                                                   options.get('HEDGE_DELAY_MS', 20), options.get('HEDGE_WORKERS', 8))
+        self.write_buffer = None
+        if options.get('WRITE_BEHIND', False):
+            self.write_buffer = get_write_buffer(process_name, self._flush_writes,
+                                                 options.get('WRITE_BEHIND_MAX_SIZE', 10000),
+                                                 options.get('WRITE_BEHIND_BATCH_SIZE', 500),
+                                                 options.get('WRITE_BEHIND_INTERVAL', 0.5),
+                                                 options.get('WRITE_BEHIND_DROP_OLDEST', False))
         self.log = logging.getLogger(__name__)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def add(self, key, value, timeout=None, version=None):
+    @guarded(lambda args, kwargs: False)
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_key(key, version)
         self.validate_key(key)
-        self._base_set('add', key, value, timeout)
+        return self._base_set('add', key, value, timeout)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def set(self, key, value, timeout=None, version=None):
+    @guarded(lambda args, kwargs: None)
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_key(key, version)
         self.validate_key(key)
         self._base_set('set', key, value, timeout)
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def make_key(self, key, version=None):
+        key = super(MongoDBCache, self).make_key(key, version)
+        if self._hash_keys:
+            return hash_key(key, self._hash_algorithm)
+        return key
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def validate_key(self, key):
@@ -79,10 +290,124 @@ class MongoDBCache(BaseCache):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _base_set(self, mode, key, value, timeout=None):
+    def _lookup_ids(self, keys):
+        # maps every _id a key may be stored under back to the key
+        owners = dict((key, key) for key in keys)
+        if self._hash_keys_migration:
+            owners.update((key.original, key) for key in keys if isinstance(key, HashedKey))
+        return owners
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _collides(self, key, document):
+        # the document is stored under the digest of `key`, but for another key
+        if isinstance(key, HashedKey) and document['_id'] == key and document.get('key') != key.original:
+            self.log.warning('Hash collision between cache keys {0} and {1}'.format(key.original,
+                                                                                     document.get('key')))
+            return True
+        return False
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _owned_ids(self, owners, documents):
+        return [document['_id'] for document in documents if not self._collides(owners[document['_id']], document)]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _pick(self, owners, documents):
+        picked = {}
+        for document in documents:
+            key = owners[document['_id']]
+            if self._collides(key, document):
+                continue
+            # the document stored under the digest wins over a legacy one stored under the full key
+            if key not in picked or document['_id'] == key:
+                picked[key] = document
+        return picked
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _find_one(self, coll, key, projection=None):
+        owners = self._lookup_ids([key])
+        if len(owners) == 1:
+            documents = [coll.find_one({'_id': key}, projection, max_time_ms=self._max_time_ms)]
+        else:
+            documents = coll.find({'_id': {'$in': list(owners)}}, projection).max_time_ms(self._max_time_ms)
+        return self._pick(owners, [document for document in documents if document]).get(key)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _id_filter(self, key):
+        if isinstance(key, HashedKey):
+            return {'_id': key, 'key': key.original}
+        return {'_id': key}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: list(args[0]))
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        coll = self._get_collection()
+        keys = []
+        parsed_keys = []
+        requests = []
+        failed = []
+        rejected = []
+        for key, value in data.items():
+            pkey = self.make_key(key, version)
+            self.validate_key(pkey)
+            document, chunks = self._documents(pkey, value, timeout)
+            if document is None:
+                failed.append(key)
+                rejected.append(pkey)
+                continue
+            if self.write_buffer is not None and not chunks:
+                if not self.write_buffer.put(pkey, ('set', document)):
+                    failed.append(key)
+                self._invalidate_local([pkey])
+                continue
+            if chunks:
+                # chunked values need several documents, they don't fit into a single upsert
+                if self.write_buffer is not None:
+                    self.write_buffer.discard([pkey])
+                try:
+                    self._write_chunked(coll, document, chunks)
+                    self._invalidate_local([pkey])
+                except PyMongoError:
+                    self.log.exception('Failed to set cache key {0}'.format(pkey))
+                    failed.append(key)
+                continue
+            keys.append(key)
+            parsed_keys.append(pkey)
+            requests.append(ReplaceOne({'_id': pkey}, document, upsert=True))
+        if rejected:
+            # an older value must not outlive a set that was not cached
+            self._delete_keys(coll, rejected)
+        if not requests:
+            return failed
+        # drop chunks left behind by previous, larger values stored under the same keys
+        requests.append(DeleteMany({'parent': {'$in': parsed_keys}}))
+        try:
+            coll.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error['index'] >= len(keys):
+                    continue
+                failed_key = keys[error['index']]
+                self.log.error('Failed to set cache key {0}: {1}'.format(failed_key, error.get('errmsg')))
+                failed.append(failed_key)
+        except PyMongoError:
+            self.log.exception('Bulk write of {0} cache keys failed'.format(len(requests)))
+            failed.extend(keys)
+        self._invalidate_local(parsed_keys)
+        self._maybe_cull()
+        return failed
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _extra_props(self, value):
         extra_props = {}
         if isinstance(value, dict):
-            for k, v in value.iteritems():
+            for k, v in value.items():
                 if isinstance(v, str) or isinstance(v, int) or isinstance(v, float) \
                         or isinstance(v, bool):
                     extra_props[k] = v
@@ -92,151 +417,927 @@ class MongoDBCache(BaseCache):
         extra_props.pop('_id', None)
         extra_props.pop('data', None)
         extra_props.pop('chunks', None)
+        extra_props.pop('expires', None)
+        extra_props.pop('accessed', None)
+        extra_props.pop('parent', None)
+        extra_props.pop('lease', None)
+        extra_props.pop('stale_after', None)
+        extra_props.pop('value', None)
+        extra_props.pop('size', None)
+        extra_props.pop('key', None)
+        return extra_props
 
-        coll = self._get_collection()
-        encoded = self._encode(value)
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _is_native_int(self, value):
+        return isinstance(value, six.integer_types) and not isinstance(value, bool) \
+            and MIN_INT64 <= value <= MAX_INT64
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _documents(self, key, value, timeout):
+        # returns (None, []) for values larger than the MAX_ENTRY_SIZE of their resource
+        document = self._extra_props(value)
+        policy = self.policies.get(document.get('resource_name')) if self.policies is not None else {}
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = policy.get('TIMEOUT', timeout)
+        expiry_props = self._expiry_props(timeout)
+        document.update(expiry_props)
+        document['_id'] = key
+        if isinstance(key, HashedKey):
+            document['key'] = key.original
+        if self._is_native_int(value):
+            # stored as a BSON number, so incr/decr can use $inc
+            document['value'] = value
+            document['size'] = 8
+            return document, []
+        encoded = self._encode(value, document.get('resource_name'))
         document_size = len(encoded)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
+        # payload size is kept next to the payload, so introspection never has to read it
+        document['size'] = document_size
+        if policy.get('MAX_ENTRY_SIZE') and document_size > policy['MAX_ENTRY_SIZE']:
+            self.policies.record_rejected(document.get('resource_name'))
+            return None, []
+        if document_size <= MAX_SIZE:
+            document['data'] = encoded
+            return document, []
+        # every write gets its own chunk ids, so concurrent writers and readers of the same key never mix chunks
+        generation = str(ObjectId())
+        chunks = []
+        for i in range(0, document_size, CHUNK_SIZE):
+            chunk = {'_id': '{0}:{1}:{2}'.format(key, generation, i // CHUNK_SIZE), 'parent': key,
+                     'data': Binary(encoded[i:i + CHUNK_SIZE])}
+            chunk.update(expiry_props)
+            chunks.append(chunk)
+        document['chunks'] = [chunk['_id'] for chunk in chunks]
+        return document, chunks
 
-        if data and (mode == 'set' or mode == 'add'):
-            pass
-        if not self._compression or document_size <= MAX_SIZE:
-            extra_props.update({'_id': key, 'data': encoded})
-            coll.insert_one(extra_props)
-        else:
-            chunk_keys = []
-            chunks = []
-            for i in range(0, document_size, MAX_SIZE):
-                chunk = encoded[i:i + MAX_SIZE]
-                aux_key = self.make_key(chunk)
-                extra_props.update({'_id': aux_key, 'data': chunk})
-                chunk.append(extra_props)
-                chunk_keys.append(aux_key)
-            coll.insert_many(chunks)
-            extra_props.update({'_id': key, 'chunks': chunk_keys})
-            coll.insert_one(extra_props)
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _write_chunked(self, coll, document, chunks, query=None):
+        # `query` restricts which existing document may be replaced, see _base_set
+        coll.insert_many(chunks, ordered=False)
+        # the parent document is written last, so readers only ever see it with all of its chunks in place
+        try:
+            coll.replace_one(query or {'_id': document['_id']}, document, upsert=True)
+        except DuplicateKeyError:
+            coll.delete_many({'_id': {'$in': document['chunks']}})
+            raise
+        coll.delete_many({'parent': document['_id'], '_id': {'$nin': document['chunks']}})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _expiry_props(self, timeout):
+        props = {'accessed': datetime.utcnow()}
+        expires = self.get_backend_timeout(timeout)
+        if expires is not None:
+            # documents without 'expires' are ignored by the TTL index and never expire
+            props['expires'] = datetime.utcfromtimestamp(expires)
+            if self._stale_grace:
+                props['stale_after'] = props['expires']
+                props['expires'] += timedelta(seconds=self._stale_grace)
+        return props
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _stale(self, document):
+        stale_after = document.get('stale_after')
+        return stale_after is not None and stale_after <= datetime.utcnow()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _serve_stale(self, key, version, refresh, timeout=DEFAULT_TIMEOUT):
+        self.refresher.record_stale()
+        if refresh is None:
+            return
+
+        def job():
+            value = refresh(key)
+            if value is not None:
+                self.set(key, value, timeout, version)
+
+        self.refresher.submit(self.make_key(key, version), job)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _expired(self, document):
+        # the TTL monitor only runs once a minute, so documents may outlive their expiry for a while
+        expires = document.get('expires')
+        return expires is not None and expires <= datetime.utcnow()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _base_set(self, mode, key, value, timeout=DEFAULT_TIMEOUT):
+        document, chunks = self._documents(key, value, timeout)
+        if document is None:
+            if mode == 'set':
+                self._delete_keys(self._get_collection(), [key])
+            return False
+        if self.write_buffer is not None and mode == 'set' and not chunks:
+            accepted = self.write_buffer.put(key, (mode, document))
+            self._invalidate_local([key])
+            return accepted
+        if self.write_buffer is not None:
+            # 'add' is always written through, its result has to reflect what is in Mongo (cache.add is used for
+            # locks across processes); a live write still pending for the key counts as existing
+            if mode == 'add' and self._pending(key) is not None:
+                return False
+            # a pending write of an older value must not overwrite this one when it is flushed
+            self.write_buffer.discard([key])
+        coll = self._get_collection()
+        query = {'_id': key}
+        if mode == 'add':
+            # only an expired document may be replaced; when a live one exists the upsert collides on _id, so two
+            # concurrent adds can never both succeed
+            query['expires'] = {'$lte': datetime.utcnow()}
+        try:
+            if not chunks:
+                # the replaced document comes back in the same round trip, reduced to its list of chunks
+                data = coll.find_one_and_replace(query, document, projection={'_id': True, 'chunks': True},
+                                                 upsert=True)
+                if data and data.get('chunks'):
+                    coll.delete_many({'parent': key})
+            else:
+                self._write_chunked(coll, document, chunks, query)
+        except DuplicateKeyError:
+            return False
+        self._invalidate_local([key])
+        self._maybe_cull()
+        return True
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _decode(self, data):
-        if self._compression:
-            return pickle.loads(zlib.decompress(base64.decodestring(data)))
-        return pickle.loads(data)
+        if isinstance(data, six.integer_types):
+            return data
+        if self._pipeline.is_payload(data):
+            return self._pipeline.loads(data)
+        # entries written before the serializer pipeline was introduced: plain pickles (protocol >= 2 starts
+        # with 0x80) or base64 encoded zlib compressed pickles
+        if isinstance(data, bytes) and data[:1] == b'\x80':
+            return pickle.loads(bytes(data))
+        return pickle.loads(zlib.decompress(base64.b64decode(data)))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _encode(self, data, resource_name=None):
+        # whether the payload got compressed is recorded in its header, so decoding never has to guess
+        payload, raw_size, compressed, elapsed = self._pipeline.encode(data)
+        self.codec_stats.record(resource_name, raw_size, len(payload), compressed, elapsed)
+        return Binary(payload)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _decode_document(self, key, raw, document):
+        if self.near_cache is None or not self._pipeline.is_payload(raw):
+            return self._decode(raw)
+        serializer, body = self._pipeline.unpack(raw)
+        # stale entries must come back from Mongo, otherwise nothing would trigger their refresh
+        expires = document.get('stale_after') or document.get('expires')
+        if expires is not None:
+            expires = calendar.timegm(expires.utctimetuple()) + expires.microsecond / 1e6
+        self.near_cache.set(key, serializer, body, expires)
+        return serializer.loads(body)
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _flush_writes(self, batch):
+        requests = []
+        replaced = []
+        for key, (_, document) in batch:
+            requests.append(ReplaceOne({'_id': key}, document, upsert=True))
+            replaced.append(key)
+        requests.append(DeleteMany({'parent': {'$in': replaced}}))
+        try:
+            self._get_collection().bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            self.log.error('{0} of {1} buffered cache writes failed'.format(len(e.details.get('writeErrors', [])),
+                                                                          len(batch)))
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _encode(self, data):
-        if self._compression:
-            return base64.encodestring(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), self.compression_level))
-        return Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    @guarded()
+    def flush(self):
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+    def write_behind_stats(self):
+        if self.write_buffer is None:
+            return None
+        return self.write_buffer.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _pending(self, key):
+        # the live document of a write still waiting in the buffer, or None
+        if self.write_buffer is None:
+            return None
+        operation = self.write_buffer.get(key)
+        if operation is None or self._expired(operation[1]) or self._collides(key, operation[1]):
+            return None
+        return operation[1]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _discard_pending(self, keys):
+        if self.write_buffer is None:
+            return
+        discarded = []
+        for key in keys:
+            operation = self.write_buffer.get(key)
+            # a write pending under the same digest for another key (a hash collision) is kept
+            if operation is None or not self._collides(key, operation[1]):
+                discarded.append(key)
+        self.write_buffer.discard(discarded)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _get_pending(self, key):
+        document = self._pending(key)
+        if document is None:
+            return _MISSING
+        return self._decode(document['value'] if 'value' in document else document['data'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _invalidate_local(self, keys):
+        if self.near_cache is None or not self._near_cache_invalidate:
+            return
+        for key in keys:
+            self.near_cache.delete(key)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: _argument(args, kwargs, 1, 'default'))
     def get(self, key, default=None, version=None):
-        coll = self._get_collection()
-        key = self.make_key(key, version)
-        self.validate_key(key)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
-        if not data:
+        pkey = self.make_key(key, version)
+        self.validate_key(pkey)
+        value = self._get_local(pkey)
+        if value is _MISSING:
+            value = self._get_pending(pkey)
+        if value is not _MISSING:
+            return value
+        data, raw = self._read(lambda coll: self._fetch(coll, pkey))
+        if not data or self._expired(data):
             return default
+        if self._stale(data):
+            self._serve_stale(key, version, self._refresh_callback)
+        self._touch([pkey])
+        return self._decode_document(pkey, raw, data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _get_local(self, key):
+        if self.near_cache is None:
+            return _MISSING
+        local = self.near_cache.get(key)
+        if local is None:
+            return _MISSING
+        serializer, body = local
+        return serializer.loads(body)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fetch(self, coll, key):
+        data = self._find_one(coll, key)
+        if not data:
+            return None, None
+        if 'value' in data:
+            return data, data['value']
         raw = data.get('data')
         if not raw:
             chunks = data.get('chunks')
-            if chunks:
-                raw = ''
-                for chunk in chunks:
-                    raw += coll.find_one({'_id': chunk}, max_time_ms=self._max_time_ms)['data']
-            else:
-                return default
-        return self._decode(raw)
+            if not chunks:
+                return None, None
+            raw = self._join_chunks(chunks, self._fetch_chunks(coll, chunks))
+            if raw is None:
+                return None, None
+        return data, raw
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def get_many(self, keys, version=None):
+    @guarded(_call_default)
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        pkey = self.make_key(key, version)
+        self.validate_key(pkey)
+        value = self._get_local(pkey)
+        if value is _MISSING:
+            value = self._get_pending(pkey)
+        if value is not _MISSING:
+            return value
         coll = self._get_collection()
+        data, raw = self._read(lambda read_coll: self._fetch(read_coll, pkey))
+        stale = _MISSING
+        if data:
+            if not self._expired(data):
+                if self._stale(data):
+                    refresh = (lambda refresh_key: default()) if callable(default) else None
+                    self._serve_stale(key, version, refresh, timeout)
+                self._touch([pkey])
+                return self._decode_document(pkey, raw, data)
+            if self._lease_serve_stale:
+                stale = self._decode(raw)
+
+        token = self._acquire_lease(coll, pkey)
+        if token is None:
+            # somebody else is recomputing the value: serve what we have or wait for them to finish
+            if stale is not _MISSING:
+                return stale
+            deadline = time.time() + self._lease_wait
+            while time.time() < deadline:
+                time.sleep(self._lease_poll_interval)
+                value = self.get(key, _MISSING, version)
+                if value is not _MISSING:
+                    return value
+            self.log.warning('Gave up waiting for lease on cache key {0}, recomputing'.format(pkey))
+        try:
+            if callable(default):
+                default = default()
+            if default is not None:
+                self.set(key, default, timeout, version)
+            return default
+        finally:
+            if token is not None:
+                self._release_lease(coll, pkey, token)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _acquire_lease(self, coll, key):
+        token = str(ObjectId())
+        now = datetime.utcnow()
+        # leases have a field of their own rather than 'parent': deleting or rewriting the chunks of the key must not
+        # take a lease held on it with them
+        lease = {'lease': key, 'owner': token, 'expires': now + timedelta(seconds=self._lease_timeout)}
+        try:
+            # matches only a lease left behind by a crashed worker, otherwise the upsert collides on _id
+            coll.replace_one({'_id': key + LEASE_SUFFIX, 'expires': {'$lte': now}}, lease, upsert=True)
+        except DuplicateKeyError:
+            return None
+        return token
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _release_lease(self, coll, key, token):
+        try:
+            coll.delete_one({'_id': key + LEASE_SUFFIX, 'owner': token})
+        except PyMongoError:
+            self.log.exception('Failed to release lease on cache key {0}'.format(key))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fetch_chunks(self, coll, chunk_keys):
+        data = coll.find({'_id': {'$in': chunk_keys}}, {'data': 1}).max_time_ms(self._max_time_ms)
+        return dict((chunk['_id'], chunk['data']) for chunk in data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _join_chunks(self, chunk_keys, fetched):
+        try:
+            return b''.join([fetched[chunk_key] for chunk_key in chunk_keys])
+        except KeyError:
+            # the value was overwritten or deleted while we were reading it
+            return None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: {})
+    def get_many(self, keys, version=None):
         out = {}
         parsed_keys = {}
         for key in keys:
             pkey = self.make_key(key, version)
             self.validate_key(pkey)
+            value = self._get_local(pkey)
+            if value is _MISSING:
+                value = self._get_pending(pkey)
+            if value is not _MISSING:
+                out[key] = value
+                continue
             parsed_keys[pkey] = key
-        data = coll.find({'_id': {'$in': parsed_keys.keys()}}).max_time_ms(self._max_time_ms)
-        for result in data:
+        if not parsed_keys:
+            return out
+        hits = []
+        for pkey, result, raw in self._read(lambda coll: self._fetch_many(coll, list(parsed_keys))):
+            hits.append(result['_id'])
+            if self._stale(result):
+                self._serve_stale(parsed_keys[pkey], version, self._refresh_callback)
+            out[parsed_keys[pkey]] = self._decode_document(pkey, raw, result)
+        self._touch(hits)
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fetch_many(self, coll, keys):
+        owners = self._lookup_ids(keys)
+        data = coll.find({'_id': {'$in': list(owners)}}).max_time_ms(self._max_time_ms)
+        results = self._pick(owners, [result for result in data if not self._expired(result)])
+        chunk_keys = [chunk_key for result in results.values() for chunk_key in result.get('chunks') or []]
+        fetched = self._fetch_chunks(coll, chunk_keys) if chunk_keys else {}
+        resolved = []
+        for key, result in results.items():
             raw = result.get('data')
             chunks = result.get('chunks')
-            if chunks:
-                raw = ''
-                for chunk in chunks:
-                    raw += coll.find_one({'_id': chunk}, max_time_ms=self._max_time_ms)['data']
-            out[parsed_keys[result['_id']]] = self._decode(raw)
-        return out
+            if 'value' in result:
+                raw = result['value']
+            elif chunks:
+                raw = self._join_chunks(chunks, fetched)
+            if raw is None or raw == b'':
+                continue
+            resolved.append((key, result, raw))
+        return resolved
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _read(self, read):
+        coll = self._get_collection()
+        if self.hedged_reader is None:
+            return read(coll)
+        # the whole read, chunks included, runs against one member so it never mixes replicas
+        return self.hedged_reader.read(read, coll.with_options(read_preference=PrimaryPreferred()),
+                                       coll.with_options(read_preference=Secondary(tag_sets=self._tag_sets)),
+                                       getattr(self.connection, 'primary', None))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def hedge_stats(self):
+        if self.hedged_reader is None:
+            return None
+        return self.hedged_reader.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
+    def incr(self, key, delta=1, version=None):
+        pkey = self.make_key(key, version)
+        self.validate_key(pkey)
+        if self.write_buffer is not None and self.write_buffer.get(pkey) is not None:
+            # the counter has to be in Mongo before $inc can see it
+            self.write_buffer.flush()
+        coll = self._get_collection()
+        now = datetime.utcnow()
+        query = self._id_filter(pkey)
+        query.update({'value': {'$exists': True}, '$or': [{'expires': None}, {'expires': {'$gt': now}}]})
+        data = coll.find_one_and_update(
+            query,
+            {'$inc': {'value': delta}, '$set': {'accessed': now}},
+            projection={'value': True}, return_document=ReturnDocument.AFTER, max_time_ms=self._max_time_ms)
+        if data is not None:
+            self._invalidate_local([pkey])
+            return data['value']
+        # missing, expired or pickled by an older version: BaseCache raises ValueError or rewrites it as a number
+        return super(MongoDBCache, self).incr(key, delta, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: {})
+    def incr_many(self, deltas, timeout=DEFAULT_TIMEOUT, version=None, return_values=True):
+        if not isinstance(deltas, dict):
+            deltas = dict((key, 1) for key in deltas)
+        if not deltas:
+            return {}
+        coll = self._get_collection()
+        insert_props = self._expiry_props(timeout)
+        now = insert_props.pop('accessed')
+        # what set() stores along with a number, so quotas and stats_by_resource see the counters
+        insert_props.update(self._extra_props(0), size=8)
+        parsed_keys = {}
+        for key, delta in deltas.items():
+            pkey = self.make_key(key, version)
+            self.validate_key(pkey)
+            parsed_keys[pkey] = key
+        if self.write_buffer is not None and any(self.write_buffer.get(pkey) is not None for pkey in parsed_keys):
+            # the counters have to be in Mongo before $inc can see them
+            self.write_buffer.flush()
+        # counters are created on first use; keys holding anything else are left alone and missing from the result
+        pending = list(parsed_keys)
+        while pending:
+            requests = [UpdateOne(*self._counter_update(pkey, deltas[parsed_keys[pkey]], now, insert_props),
+                                  upsert=True) for pkey in pending]
+            try:
+                coll.bulk_write(requests, ordered=False)
+                break
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if not errors or any(error.get('code') != 11000 for error in errors):
+                    raise
+                # the upsert collided with an expired counter not reaped yet or with a key that is not a counter
+                pending = [pending[error['index']] for error in errors]
+                if not self._delete_expired(coll, pending, now):
+                    break
+        self._invalidate_local(list(parsed_keys))
+        if not return_values:
+            return None
+        # read back in one more round trip rather than one per counter; increments made by other clients in between
+        # are included
+        owners = dict((pkey, pkey) for pkey in parsed_keys)
+        documents = coll.find({'_id': {'$in': list(parsed_keys)}}, {'value': True, 'key': True})\
+            .max_time_ms(self._max_time_ms)
+        return dict((parsed_keys[pkey], document['value'])
+                    for pkey, document in self._pick(owners, documents).items() if 'value' in document)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+    def _counter_update(self, pkey, delta, now, insert_props):
+        # the key side field of hashed keys is part of the filter, so upserts store it too
+        query = self._id_filter(pkey)
+        query.update({'value': {'$exists': True}, '$or': [{'expires': None}, {'expires': {'$gt': now}}]})
+        return query, {'$inc': {'value': delta}, '$set': {'accessed': now}, '$setOnInsert': insert_props}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _delete_expired(self, coll, keys, now):
+        return coll.delete_many({'_id': {'$in': keys}, 'expires': {'$lte': now}}).deleted_count
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: None)
     def delete(self, key, version=None):
-        pass
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        coll = self._get_collection()
+        self._delete_keys(coll, [key])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: None)
+    def delete_many(self, keys, version=None):
+        parsed_keys = []
+        for key in keys:
+            pkey = self.make_key(key, version)
+            self.validate_key(pkey)
+            parsed_keys.append(pkey)
+        if not parsed_keys:
+            return
+        coll = self._get_collection()
+        self._delete_keys(coll, parsed_keys)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
+    def delete_by(self, resource_name=None, **props):
+        if resource_name is not None:
+            props['resource_name'] = resource_name
+        if not props:
+            raise ValueError('delete_by needs at least one property, use clear() to remove everything')
+        coll = self._get_collection()
+        props = self._entry_filter(**props)
+        deleted = 0
+        batch = []
+        # deleting by key in batches also takes the chunks and near cache entries of every matching document
+        for document in coll.find(props, {'_id': True}).batch_size(DELETE_BATCH_SIZE):
+            batch.append(document['_id'])
+            if len(batch) == DELETE_BATCH_SIZE:
+                self._delete_keys(coll, batch)
+                deleted += len(batch)
+                batch = []
+        if batch:
+            self._delete_keys(coll, batch)
+            deleted += len(batch)
+        return deleted
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+    def _delete_keys(self, coll, keys):
+        self._discard_pending(keys)
+        owners = self._lookup_ids(keys)
+        if any(isinstance(key, HashedKey) for key in keys):
+            # a digest shared with another key (a hash collision) must not take that key's entry with it
+            documents = coll.find({'_id': {'$in': list(owners)}}, {'_id': True, 'key': True})\
+                .max_time_ms(self._max_time_ms)
+            ids = self._owned_ids(owners, documents)
+        else:
+            ids = list(owners)
+        coll.delete_many({'_id': {'$in': ids}})
+        coll.delete_many({'parent': {'$in': ids}})
+        self._invalidate_local(keys)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded(lambda args, kwargs: False)
     def has_key(self, key, version=None):
         coll = self._get_collection()
         key = self.make_key(key, version)
         self.validate_key(key)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
-        return data is not None
+        if self._pending(key) is not None:
+            return True
+        data = self._find_one(coll, key, {'_id': True, 'expires': True, 'key': True})
+        return data is not None and not self._expired(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _entry_filter(self, **props):
+        # the documents of cache entries, not their chunks or leases
+        props.update({'parent': {'$exists': False}, 'lease': {'$exists': False}})
+        return props
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _live_filter(self, **props):
+        # entries that have not expired yet
+        props = self._entry_filter(**props)
+        props['$or'] = [{'expires': None}, {'expires': {'$gt': datetime.utcnow()}}]
+        return props
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
+    def stats_by_resource(self):
+        coll = self._get_collection()
+        pipeline = [
+            {'$match': self._live_filter()},
+            {'$group': {'_id': '$resource_name', 'count': {'$sum': 1},
+                        'size': {'$sum': {'$ifNull': ['$size', 0]}},
+                        'max_size': {'$max': {'$ifNull': ['$size', 0]}}}},
+            {'$sort': {'size': -1}},
+        ]
+        return dict((row['_id'], {'count': row['count'], 'size': row['size'], 'max_size': row['max_size']})
+                    for row in coll.aggregate(pipeline, maxTimeMS=self._max_time_ms))
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+    @guarded()
+    def list_keys(self, after=None, limit=100, **props):
+        coll = self._get_collection()
+        query = self._live_filter(**props)
+        if after is not None:
+            # keyset pagination: pass the last key of the previous page
+            query['_id'] = {'$gt': after}
+        # with HASH_KEYS the _id is a digest and the key itself comes in 'key'
+        data = coll.find(query, {'_id': True, 'key': True, 'resource_name': True, 'size': True, 'expires': True})\
+            .sort('_id', pymongo.ASCENDING).limit(limit).max_time_ms(self._max_time_ms)
+        return list(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
+    def size_histogram(self, boundaries=None, **props):
+        coll = self._get_collection()
+        boundaries = boundaries or SIZE_BUCKETS
+        pipeline = [
+            {'$match': self._live_filter(**props)},
+            {'$bucket': {'groupBy': {'$ifNull': ['$size', 0]}, 'boundaries': boundaries, 'default': 'larger',
+                         'output': {'count': {'$sum': 1}, 'size': {'$sum': {'$ifNull': ['$size', 0]}}}}},
+        ]
+        return [(row['_id'], row['count'], row['size'])
+                for row in coll.aggregate(pipeline, maxTimeMS=self._max_time_ms)]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
     def clear(self):
-        pass
+        if self.write_buffer is not None:
+            self.write_buffer.clear()
+        coll = self._get_collection()
+        coll.delete_many({})
+        if self.near_cache is not None:
+            self.near_cache.clear()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_documents(self, batch_size=1000):
+        # every live document as stored, chunks before the documents owning them and without leases, so a restore
+        # never exposes a document whose chunks are not in place yet
+        self.flush()
+        coll = self._get_collection()
+        live = {'$or': [{'expires': None}, {'expires': {'$gt': datetime.utcnow()}}]}
+        for query in ({'parent': {'$exists': True}}, self._entry_filter()):
+            query.update(live)
+            for document in coll.find(query).batch_size(batch_size):
+                yield document
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @guarded()
+    def restore_documents(self, documents, batch_size=1000):
+        # documents as produced by iter_documents, written with unordered bulk upserts of batch_size documents
+        coll = self._get_collection()
+        restored = 0
+        requests = []
+        for document in documents:
+            requests.append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+            if len(requests) == batch_size:
+                coll.bulk_write(requests, ordered=False)
+                restored += len(requests)
+                requests = []
+        if requests:
+            coll.bulk_write(requests, ordered=False)
+            restored += len(requests)
+        if self.near_cache is not None:
+            self.near_cache.clear()
+        return restored
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @contextmanager
+    def _latency_budget(self):
+        if self._latency_budget_ms and hasattr(pymongo, 'timeout'):
+            # client side operation timeout, available from pymongo 4.2; older versions get a socket timeout capped
+            # by the budget from _client_kwargs
+            with pymongo.timeout(self._latency_budget_ms / 1000.0):
+                yield
+        else:
+            yield
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def circuit_stats(self):
+        if self.breaker is None:
+            return None
+        return self.breaker.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def stale_stats(self):
+        if self.refresher is None:
+            return None
+        return self.refresher.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def near_cache_stats(self):
+        if self.near_cache is None:
+            return None
+        return self.near_cache.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def compression_stats(self):
+        return self.codec_stats.stats()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _touch(self, keys):
+        if not self._track_access or not keys:
+            return
+        # access times only steer culling, so an unacknowledged write is good enough and costs no round trip
+        coll = self._get_collection().with_options(write_concern=WriteConcern(w=0))
+        coll.update_many({'_id': {'$in': keys}}, {'$set': {'accessed': datetime.utcnow()}})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _maybe_cull(self):
+        # starts the background threads enforcing MAX_ENTRIES and the resource quotas, if not running yet
+        if self.policies is not None:
+            self.policies.start(self._enforce_quotas)
+        if self.culler is not None:
+            self.culler.start(self._cull)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _count(self, coll):
+        if hasattr(coll, 'estimated_document_count'):
+            return coll.estimated_document_count()
+        return coll.count()
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _cull(self):
-        pass
+        # runs in the background thread of self.culler
+        coll = self._get_collection()
+        count = self._count(coll)
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        # other processes cull the same collection; working towards a target size rather than a number of deletions
+        # keeps them from evicting a share each
+        target = count - count // self._cull_frequency
+        while count > target:
+            batch = coll.find(self._entry_filter(), {'_id': 1}).sort('accessed', pymongo.ASCENDING)\
+                .limit(min(count - target, self._cull_batch_size)).max_time_ms(self._max_time_ms)
+            keys = [doc['_id'] for doc in batch]
+            if not keys:
+                break
+            self._delete_keys(coll, keys)
+            time.sleep(self._cull_pause)
+            count = self._count(coll)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _enforce_quotas(self):
+        # runs in the background thread of ResourcePolicies
+        coll = self._get_collection()
+        quotas = self.policies.quotas
+        pipeline = [
+            {'$match': {'resource_name': {'$in': list(quotas)}, 'parent': {'$exists': False}}},
+            {'$group': {'_id': '$resource_name', 'size': {'$sum': {'$ifNull': ['$size', 0]}}}},
+        ]
+        usage = dict((row['_id'], row['size']) for row in coll.aggregate(pipeline))
+        for resource_name, size in usage.items():
+            excess = size - quotas[resource_name]
+            # least recently used entries of the resource go first, a small batch at a time
+            while excess > 0:
+                batch = coll.find({'resource_name': resource_name, 'parent': {'$exists': False}},
+                                  {'_id': True, 'size': True}).sort('accessed', pymongo.ASCENDING)\
+                    .limit(self._quota_batch_size)
+                keys = []
+                freed = 0
+                for document in batch:
+                    keys.append(document['_id'])
+                    freed += document.get('size') or 0
+                    if freed >= excess:
+                        break
+                if not keys:
+                    break
+                self._delete_keys(coll, keys)
+                self.policies.record_evicted(resource_name, len(keys), freed)
+                excess -= freed
+                size -= freed
+                time.sleep(self._quota_pause)
+            usage[resource_name] = size
+        self.policies.record_usage(usage)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def quota_stats(self):
+        if self.policies is None:
+            return None
+        return self.policies.stats()
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _get_collection(self):
-        if not getattr(self, '_coll', None):
+        # a collection inherited over fork() would share the parent's sockets
+        if getattr(self, '_coll', None) is None or self._pid != os.getpid():
             self._initialize_collection()
         return self._coll
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _client_kwargs(self):
+        socket_timeout_ms = self._socket_timeout_ms
+        connect_timeout_ms = self._connect_timeout_ms
+        server_selection_timeout_ms = self._server_selection_timeout_ms
+        if self._latency_budget_ms:
+            # calls to an unreachable server would otherwise hang for the whole server selection timeout, including
+            # the ones made outside of the budget (background threads, iter_documents)
+            budget = self._latency_budget_ms
+            connect_timeout_ms = min(connect_timeout_ms or budget, budget)
+            server_selection_timeout_ms = min(server_selection_timeout_ms or budget, budget)
+            if not hasattr(pymongo, 'timeout'):
+                # no client side operation timeout before pymongo 4.2, see _latency_budget
+                socket_timeout_ms = min(socket_timeout_ms or budget, budget)
+        kwargs = dict(host=self._host, replicaset=self._rsname, sockettimeoutms=socket_timeout_ms,
+                      connecttimeoutms=connect_timeout_ms, serverSelectionTimeoutMS=server_selection_timeout_ms,
+                      read_preference=self._read_preference)
+        if self._user and self._password:
+            kwargs.update(username=self._user, password=self._password, authSource=self._auth_db)
+        if self._max_pool_size is not None:
+            kwargs['maxPoolSize'] = self._max_pool_size
+        if self._min_pool_size is not None:
+            kwargs['minPoolSize'] = self._min_pool_size
+        if self._wait_queue_timeout_ms is not None:
+            kwargs['waitQueueTimeoutMS'] = self._wait_queue_timeout_ms
+        if self.hedged_reader is not None:
+            kwargs['event_listeners'] = [self.hedged_reader.tracker]
+        return kwargs
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _create_client(self):
+        if self._mock:
+            import mongomock
+            return mongomock.MongoClient()
+        return pymongo.MongoClient(connect=False, **self._client_kwargs())
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _initialize_collection(self):
-        try:
+        if self._patch_gevent:
             from gevent import monkey
             monkey.patch_socket()
-        except ImportError:
-            pass
-
-        self.connection = pymongo.MongoClient(connect=False, host=self._host, replicaset=self._rsname,
-            sockettimeoutms=self._socket_timeout_ms, connecttimeoutms=self._connect_timeout_ms,
-            serverSelectionTimeoutMS=self._server_selection_timeout_ms, read_preference=self._read_preference)
 
+        settings = self._client_kwargs()
+        settings['mock'] = self._mock
+        # clients (and their connection pools) are shared by every backend instance with the same settings
+        self.connection = get_client(settings, self._create_client)
         self._db = self.connection[self._database]
-        if self._user and self._password:
-            try:
-                self._db.authenticate(self._user, self._password, source=self._auth_db)
-            except Exception as ex1:
-                traceback.print_exc()
-                self.log.error(
-                    'It is not possible to authenticate user {0} in auth db {1}'.format(self._user, self._auth_db)
-                )
-                raise ex1
-        if pymongo.version_tuple[0] < 3:
-            self._coll = self._db[self._collection]
+        bootstrap_once((id(self.connection), self._database, self._collection), self._bootstrap_collection)
+        self._coll = self._db.get_collection(self._collection)
+        self._pid = os.getpid()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _bootstrap_collection(self):
+        if hasattr(self._db, 'list_collection_names'):
+            exists = self._collection in self._db.list_collection_names()
         else:
-            self._coll = self._db.get_collection(self._collection)
-            if not self._coll:
+            exists = self._collection in self._db.collection_names()
+        # mongomock creates collections lazily and knows nothing about storage engines
+        if not exists and not self._mock:
+            try:
                 if self._compression:
-                    self._coll = self._db.create_collection(self._collection,
-                                                            storageEngine={'wiredTiger':
-                                                                            {'configString': 'block_compressor=none'}})
+                    self._db.create_collection(self._collection, storageEngine={'wiredTiger':
+                                                                                {'configString': 'block_compressor=none'}})
                 else:
-                    self._coll = self._db.create_collection(self._collection)
+                    self._db.create_collection(self._collection)
+            except CollectionInvalid:
+                # created by another process in the meantime
+                pass
+        self._coll = self._db.get_collection(self._collection)
 
         # create indexes if they do not exist
         if isinstance(self._collection_indexes, list) and len(self._collection_indexes):
@@ -251,4 +1352,14 @@ class MongoDBCache(BaseCache):
                 if index_name not in indexes_info:
                     self._coll.create_index(index_description)
 
+        # expired documents are reaped by the server, 'expires' holds an absolute expiry time
+        self._coll.create_index('expires', name='expires_ttl', expireAfterSeconds=0, background=True)
+        self._coll.create_index('parent', name='parent', sparse=True, background=True)
+        self._coll.create_index('resource_name', name='resource_name', sparse=True, background=True)
+        if self._cull_enabled:
+            self._coll.create_index('accessed', name='accessed', background=True)
+        if self.policies is not None and self.policies.quotas:
+            self._coll.create_index([('resource_name', pymongo.ASCENDING), ('accessed', pymongo.ASCENDING)],
+                                    name='resource_name_accessed', background=True)
+
 # ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+# Python 3.5+ only: asyncio counterpart of MongoDBCache. It shares the configuration, document layout, encoding and
+# chunk format with the synchronous class, so both APIs can be used on the same collection at the same time.
+
+import asyncio
+import functools
+import os
+import time
+from datetime import datetime
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
+
+from chembl_core_db.cache.backends.MongoDBCache import MongoDBCache, _MISSING, _argument
+from chembl_core_db.cache.backends.clientRegistry import get_loop_client
+from chembl_core_db.cache.backends.hashedKeys import HashedKey
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def aguarded(fallback):
+    # guarded() for coroutines; those of one thread interleave, so instead of tracking nested calls every call asks the
+    # breaker for itself
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if self.breaker is None:
+                return await method(self, *args, **kwargs)
+            if not self.breaker.allow():
+                return fallback(args, kwargs)
+            start = time.time()
+            try:
+                result = await method(self, *args, **kwargs)
+            except PyMongoError:
+                self.breaker.record_failure()
+                self.log.warning('Cache call {0} failed'.format(method.__name__), exc_info=True)
+                return fallback(args, kwargs)
+            except BaseException:
+                # including a cancelled call (BaseException from Python 3.8), which must not keep the probe forever
+                self.breaker.release()
+                raise
+            if self._latency_budget_ms and (time.time() - start) * 1000 > self._latency_budget_ms:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return result
+        return wrapper
+    return decorator
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _MockAsyncCursor(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def max_time_ms(self, max_time_ms):
+        self._cursor = self._cursor.max_time_ms(max_time_ms)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self._cursor)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _MockAsyncCollection(object):
+    # wraps the in-memory (mongomock) collection used by the MOCK option in motor's interface
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _MockAsyncCursor(self._collection.find(*args, **kwargs))
+
+    def with_options(self, *args, **kwargs):
+        return _MockAsyncCollection(self._collection.with_options(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class AsyncMongoDBCache(MongoDBCache):
+
+    def _get_async_collection(self):
+        # motor clients are bound to the event loop they were first used on and, like any client, to the process
+        loop = asyncio.get_event_loop()
+        if getattr(self, '_async_coll', None) is None or self._async_loop is not loop or \
+                self._async_pid != os.getpid():
+            if self._mock:
+                self._async_coll = _MockAsyncCollection(self._get_collection())
+            else:
+                # indexes and the collection itself are bootstrapped by the synchronous client
+                self._get_collection()
+                from motor.motor_asyncio import AsyncIOMotorClient
+                settings = self._client_kwargs()
+                settings['motor'] = True
+                self._async_connection = get_loop_client(loop, settings,
+                                                         lambda: AsyncIOMotorClient(**self._client_kwargs()))
+                self._async_coll = self._async_connection[self._database][self._collection]
+            self._async_loop = loop
+            self._async_pid = os.getpid()
+        return self._async_coll
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    async def _atouch(self, coll, keys):
+        # see _touch
+        if not self._track_access or not keys:
+            return
+        await coll.with_options(write_concern=WriteConcern(w=0)).update_many(
+            {'_id': {'$in': keys}}, {'$set': {'accessed': datetime.utcnow()}})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @aguarded(lambda args, kwargs: None)
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        coll = self._get_async_collection()
+        document, chunks = self._documents(key, value, timeout)
+        if document is None:
+            await self._adelete_keys(coll, [key])
+            return
+        if self.write_buffer is not None:
+            if not chunks:
+                # like set: queued for the flusher, which never blocks the event loop
+                self.write_buffer.put(key, ('set', document))
+                self._invalidate_local([key])
+                return
+            # a pending write of an older value must not overwrite this one when it is flushed
+            self.write_buffer.discard([key])
+        if not chunks:
+            data = await coll.find_one_and_replace({'_id': key}, document, projection={'_id': True, 'chunks': True},
+                                                   upsert=True)
+            if data and data.get('chunks'):
+                await coll.delete_many({'parent': key})
+        else:
+            await coll.insert_many(chunks, ordered=False)
+            await coll.replace_one({'_id': key}, document, upsert=True)
+            await coll.delete_many({'parent': key, '_id': {'$nin': document['chunks']}})
+        self._invalidate_local([key])
+        self._maybe_cull()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @aguarded(lambda args, kwargs: _argument(args, kwargs, 1, 'default'))
+    async def aget(self, key, default=None, version=None):
+        pkey = self.make_key(key, version)
+        self.validate_key(pkey)
+        value = self._get_local(pkey)
+        if value is _MISSING:
+            value = self._get_pending(pkey)
+        if value is not _MISSING:
+            return value
+        coll = self._get_async_collection()
+        owners = self._lookup_ids([pkey])
+        data = await coll.find({'_id': {'$in': list(owners)}}).max_time_ms(self._max_time_ms).to_list(None)
+        data = self._pick(owners, data).get(pkey)
+        if not data or self._expired(data):
+            return default
+        results = await self._aresolve(coll, {pkey: data})
+        if not results:
+            return default
+        if self._stale(data):
+            self._serve_stale(key, version, self._refresh_callback)
+        await self._atouch(coll, [data['_id']])
+        return self._decode_document(pkey, results[0][2], data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @aguarded(lambda args, kwargs: {})
+    async def aget_many(self, keys, version=None):
+        out = {}
+        parsed_keys = {}
+        for key in keys:
+            pkey = self.make_key(key, version)
+            self.validate_key(pkey)
+            value = self._get_local(pkey)
+            if value is _MISSING:
+                value = self._get_pending(pkey)
+            if value is not _MISSING:
+                out[key] = value
+                continue
+            parsed_keys[pkey] = key
+        if not parsed_keys:
+            return out
+        coll = self._get_async_collection()
+        owners = self._lookup_ids(list(parsed_keys))
+        data = await coll.find({'_id': {'$in': list(owners)}}).max_time_ms(self._max_time_ms).to_list(None)
+        results = self._pick(owners, [result for result in data if not self._expired(result)])
+        hits = []
+        for pkey, result, raw in await self._aresolve(coll, results):
+            hits.append(result['_id'])
+            if self._stale(result):
+                self._serve_stale(parsed_keys[pkey], version, self._refresh_callback)
+            out[parsed_keys[pkey]] = self._decode_document(pkey, raw, result)
+        await self._atouch(coll, hits)
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    async def _aresolve(self, coll, results):
+        # pairs every document (a dict of key -> document) with its payload, fetching all chunks in one query
+        chunk_keys = [chunk_key for result in results.values() for chunk_key in result.get('chunks') or []]
+        fetched = {}
+        if chunk_keys:
+            chunks = await coll.find({'_id': {'$in': chunk_keys}}, {'data': 1})\
+                .max_time_ms(self._max_time_ms).to_list(None)
+            fetched = dict((chunk['_id'], chunk['data']) for chunk in chunks)
+        resolved = []
+        for key, result in results.items():
+            if 'value' in result:
+                raw = result['value']
+            elif result.get('chunks'):
+                raw = self._join_chunks(result['chunks'], fetched)
+            else:
+                raw = result.get('data')
+            if raw is None or raw == b'':
+                continue
+            resolved.append((key, result, raw))
+        return resolved
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @aguarded(lambda args, kwargs: None)
+    async def adelete(self, key, version=None):
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        await self._adelete_keys(self._get_async_collection(), [key])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    async def _adelete_keys(self, coll, keys):
+        self._discard_pending(keys)
+        owners = self._lookup_ids(keys)
+        if any(isinstance(key, HashedKey) for key in keys):
+            # see _delete_keys
+            documents = await coll.find({'_id': {'$in': list(owners)}}, {'_id': True, 'key': True})\
+                .max_time_ms(self._max_time_ms).to_list(None)
+            ids = self._owned_ids(owners, documents)
+        else:
+            ids = list(owners)
+        await coll.delete_many({'_id': {'$in': ids}})
+        await coll.delete_many({'parent': {'$in': ids}})
+        self._invalidate_local(keys)
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import logging
+import threading
+import time
+from collections import deque
+from chembl_core_db.cache.backends.processLocal import get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def get_circuit_breaker(name, failure_threshold, window, reset_timeout):
+    return get_shared('circuit_breaker', name, lambda: CircuitBreaker(name, failure_threshold, window, reset_timeout))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `failure_threshold` failures within `window` seconds. While open every call is refused; after
+    `reset_timeout` seconds a single probe call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold, window, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened = 0
+        self.successes = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self._failures = deque()
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._failures.clear()
+                self._set_state(CLOSED)
+
+    def release(self):
+        # the call ended without telling whether Mongo is healthy, a half-open breaker lets the next call probe
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        now = time.time()
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._open(now)
+                return
+            self._failures.append(now)
+            while self._failures and self._failures[0] < now - self.window:
+                self._failures.popleft()
+            if self.state == CLOSED and len(self._failures) >= self.failure_threshold:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'opened': self.opened,
+                'successes': self.successes,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+            }
+
+    def _open(self, now):
+        self._opened_at = now
+        self.opened += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.log.warning('Circuit breaker for cache {0}: {1} -> {2}'.format(self.name, self.state, state))
+            self.state = state
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import os
+import threading
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+# One MongoClient per distinct set of connection settings and per process. Clients are not fork-safe, so whenever the
+# registry is used from a new PID (a pre-fork worker) it starts from scratch.
+
+_clients = {}
+# id(loop) -> (loop, {settings key: client}) of clients bound to an event loop (motor)
+_loop_clients = {}
+_bootstrapped = set()
+_pid = None
+_lock = threading.RLock()
+
+
+def _check_pid():
+    global _pid
+    if _pid != os.getpid():
+        # the parent's clients and their sockets belong to the parent, we only drop our references to them
+        _clients.clear()
+        _loop_clients.clear()
+        _bootstrapped.clear()
+        _pid = os.getpid()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def settings_key(settings):
+    return tuple(sorted((name, repr(value)) for name, value in settings.items()))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_client(settings, factory):
+    key = settings_key(settings)
+    with _lock:
+        _check_pid()
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_loop_client(loop, settings, factory):
+    # the loop is kept along with its clients, so while they are registered no other loop can get its id(); the clients
+    # of closed loops are dropped whenever a new loop registers
+    key = settings_key(settings)
+    with _lock:
+        _check_pid()
+        entry = _loop_clients.get(id(loop))
+        if entry is None:
+            for loop_id, (other, clients) in list(_loop_clients.items()):
+                if other.is_closed():
+                    del _loop_clients[loop_id]
+            entry = _loop_clients[id(loop)] = (loop, {})
+        clients = entry[1]
+        client = clients.get(key)
+        if client is None:
+            client = factory()
+            clients[key] = client
+        return client
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def bootstrap_once(name, bootstrap):
+    # runs collection and index creation once per process instead of once per backend instance
+    with _lock:
+        _check_pid()
+        if name in _bootstrapped:
+            return False
+        bootstrap()
+        _bootstrapped.add(name)
+        return True
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import threading
+from collections import defaultdict
+from chembl_core_db.cache.backends.processLocal import get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_compression_stats(name):
+    return get_shared('compression_stats', name, CompressionStats)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class CompressionStats(object):
+    """
+    Per resource_name counters of the compression decisions taken when values are written.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(lambda: {'values': 0, 'compressed': 0, 'raw_bytes': 0, 'stored_bytes': 0,
+                                              'compressed_raw_bytes': 0, 'compressed_bytes': 0, 'compress_time': 0.0})
+        self._lock = threading.Lock()
+
+    def record(self, resource_name, raw_size, stored_size, compressed, elapsed):
+        with self._lock:
+            counters = self._counters[resource_name]
+            counters['values'] += 1
+            counters['raw_bytes'] += raw_size
+            counters['stored_bytes'] += stored_size
+            counters['compress_time'] += elapsed
+            if compressed:
+                counters['compressed'] += 1
+                counters['compressed_raw_bytes'] += raw_size
+                counters['compressed_bytes'] += stored_size
+
+    def stats(self):
+        out = {}
+        with self._lock:
+            for resource_name, counters in self._counters.items():
+                row = dict(counters)
+                # ratio over the values that were compressed, and over everything written
+                row['ratio'] = float(row['compressed_bytes']) / row['compressed_raw_bytes'] \
+                    if row['compressed_raw_bytes'] else None
+                row['overall_ratio'] = float(row['stored_bytes']) / row['raw_bytes'] if row['raw_bytes'] else None
+                out[resource_name] = row
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import bisect
+import hashlib
+from collections import defaultdict
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class HashRing(object):
+    """
+    Consistent hash ring with virtual nodes. Positions only depend on node names, so adding or removing one of N nodes
+    moves roughly 1/N of the keys.
+    """
+
+    def __init__(self, nodes, virtual_nodes=160):
+        # nodes: either a list of names or a dict of name -> weight
+        if not isinstance(nodes, dict):
+            nodes = dict((node, 1) for node in nodes)
+        self.nodes = nodes
+        self.virtual_nodes = virtual_nodes
+        ring = []
+        for node, weight in nodes.items():
+            for i in range(int(virtual_nodes * weight)):
+                ring.append((_hash('{0}#{1}'.format(node, i)), node))
+        ring.sort()
+        self._positions = [position for position, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get_node(self, key):
+        index = bisect.bisect(self._positions, _hash(key))
+        if index == len(self._positions):
+            index = 0
+        return self._nodes[index]
+
+    def distribution(self, keys):
+        counts = defaultdict(int)
+        for key in keys:
+            counts[self.get_node(key)] += 1
+        return dict(counts)
+
+    def moved(self, other, keys):
+        # how many of `keys` would live on a different node in the `other` ring
+        return sum(1 for key in keys if self.get_node(key) != other.get_node(key))
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import hashlib
+from django.utils import six
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class HashedKey(six.text_type):
+    """
+    Fixed-width digest of a cache key, used as the document _id in place of the key itself. The full key is kept in
+    `original`; it is stored next to the digest so that a read can tell a hit from a hash collision.
+    """
+
+    def __new__(cls, digest, original=None):
+        key = six.text_type.__new__(cls, digest)
+        key.original = original
+        return key
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def hash_key(key, algorithm='sha1'):
+    raw = key.encode('utf-8') if isinstance(key, six.text_type) else key
+    return HashedKey(hashlib.new(algorithm, raw).hexdigest(), key)
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import sys
+import threading
+from collections import defaultdict, deque
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from django.utils import six
+from pymongo import monitoring
+from chembl_core_db.cache.backends.processLocal import BackgroundWorkers, get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_hedged_reader(name, percentile, default_delay_ms, workers):
+    return get_shared('hedged_reader', name, lambda: HedgedReader(LatencyTracker(percentile, default_delay_ms),
+                                                                  workers))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class LatencyTracker(monitoring.CommandListener):
+    """
+    Command listener keeping recent read latencies per replica set member, used to derive the hedging deadline.
+    """
+
+    def __init__(self, percentile, default_delay_ms, samples=1000, refresh_every=100):
+        self.percentile = percentile
+        self.default_delay_ms = default_delay_ms
+        self.refresh_every = refresh_every
+        self._samples = defaultdict(lambda: deque(maxlen=samples))
+        self._deadlines = {}
+        self._recorded = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in ('find', 'getMore'):
+            return
+        member = event.connection_id
+        with self._lock:
+            self._samples[member].append(event.duration_micros / 1000.0)
+            self._recorded[member] += 1
+            # sorting the samples on every read would cost more than the hedge saves
+            if self._recorded[member] % self.refresh_every == 1:
+                self._deadlines[member] = self._compute(self._samples[member])
+
+    def failed(self, event):
+        pass
+
+    def deadline_ms(self, member=None):
+        with self._lock:
+            if member in self._deadlines:
+                return self._deadlines[member]
+            if self._deadlines:
+                return max(self._deadlines.values())
+            return self.default_delay_ms
+
+    def stats(self):
+        with self._lock:
+            return dict(('{0}:{1}'.format(*member), {'samples': len(samples), 'deadline_ms': self._deadlines.get(member),
+                                                    'p50_ms': self._compute(samples, 50)})
+                        for member, samples in self._samples.items())
+
+    def _compute(self, samples, percentile=None):
+        ordered = sorted(samples)
+        if not ordered:
+            return None
+        index = int(round(((percentile or self.percentile) / 100.0) * (len(ordered) - 1)))
+        return ordered[index]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _Read(object):
+
+    def __init__(self, read, coll, finished):
+        self.read = read
+        self.coll = coll
+        self.finished = finished
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.read(self.coll)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done = True
+        self.finished.set()
+
+    def get(self):
+        if self.error:
+            six.reraise(*self.error)
+        return self.result
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class HedgedReader(object):
+    """
+    Runs a read against one collection handle and, if it has not answered by the deadline, the same read against a
+    second handle; whichever answers first wins.
+
+    Reads are only handed to an idle worker and never wait in a queue, where the wait would count against the deadline
+    and hedge exactly when the pool is saturated. With no idle worker the read runs unhedged on the calling thread.
+    """
+
+    def __init__(self, tracker, workers):
+        self.tracker = tracker
+        self.workers = workers
+        self.reads = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.unhedged = 0
+        self._queue = queue.Queue()
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._workers = BackgroundWorkers('cache-hedged-read', self._run, workers, self._reset)
+
+    def read(self, read, primary_coll, secondary_coll, member=None):
+        self._workers.ensure()
+        with self._lock:
+            self.reads += 1
+        finished = threading.Event()
+        first = _Read(read, primary_coll, finished)
+        if not self._dispatch(first):
+            with self._lock:
+                self.unhedged += 1
+            return read(primary_coll)
+        finished.wait(self.tracker.deadline_ms(member) / 1000.0)
+        if first.done:
+            return first.get()
+        second = _Read(read, secondary_coll, finished)
+        if not self._dispatch(second):
+            with self._lock:
+                self.unhedged += 1
+            while not first.done:
+                finished.wait()
+            return first.get()
+        with self._lock:
+            self.hedges += 1
+        while True:
+            finished.wait()
+            finished.clear()
+            for candidate, other in ((first, second), (second, first)):
+                if candidate.done and (candidate.error is None or other.done):
+                    if candidate is second and candidate.error is None:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return candidate.get()
+
+    def _dispatch(self, task):
+        with self._lock:
+            if not self._idle:
+                return False
+            self._idle -= 1
+            self._queue.put(task)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = {'reads': self.reads, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+                     'unhedged': self.unhedged}
+        stats['members'] = self.tracker.stats()
+        return stats
+
+    def _reset(self):
+        # the idle workers counted belonged to the parent process
+        with self._lock:
+            self._idle = 0
+            self._queue = queue.Queue()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+                tasks = self._queue
+            tasks.get().run()
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import threading
+import time
+from collections import OrderedDict
+from chembl_core_db.cache.backends.processLocal import get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_near_cache(name, max_bytes, timeout):
+    return get_shared('near_cache', name, lambda: NearCache(max_bytes, timeout))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class NearCache(object):
+    """
+    In-process LRU holding serialized (but already decompressed) cache payloads, bounded by their total size in bytes.
+    """
+
+    def __init__(self, max_bytes, timeout):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] <= time.time():
+                self.size -= len(entry[1])
+                self.misses += 1
+                return None
+            # re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, key, serializer, body, expires=None):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.timeout
+        if expires is not None:
+            expires_at = min(expires_at, expires)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (serializer, body, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[1])
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import logging
+import os
+import threading
+import time
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Django keeps one cache backend instance per thread, while the helpers of a cache (near cache, refresher, write
+# buffer, circuit breaker...) have to be shared by the whole process. They are registered here, one of each kind per
+# cache name.
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_shared(kind, name, factory):
+    with _registry_lock:
+        helper = _registry.get((kind, name))
+        if helper is None:
+            helper = factory()
+            _registry[(kind, name)] = helper
+        return helper
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class BackgroundWorkers(object):
+    """
+    `count` daemon threads running `target`, started by the first call to `ensure`. Threads do not survive a fork, so
+    they are started again the first time `ensure` is called in a new process, after `reset` (if given) has dropped
+    the state inherited from the parent.
+    """
+
+    def __init__(self, name, target, count=1, reset=None):
+        self.name = name
+        self.target = target
+        self.count = count
+        self.reset = reset
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.reset is not None:
+                self.reset()
+            for i in range(self.count):
+                name = self.name if self.count == 1 else '{0}-{1}'.format(self.name, i)
+                worker = threading.Thread(target=self.target, name=name)
+                worker.daemon = True
+                worker.start()
+            self._pid = os.getpid()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class PeriodicTask(object):
+    """
+    Runs a task every `interval` seconds in one background thread per process. The task is given by the first call to
+    `start`, later calls (from other backend instances of the same cache) only make sure the thread runs.
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self._task = None
+        self._workers = BackgroundWorkers(name, self._run)
+        self.log = logging.getLogger(__name__)
+
+    def start(self, task):
+        self._task = self._task or task
+        self._workers.ensure()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._task()
+            except Exception:
+                self.log.exception('Background task {0} failed'.format(self.name))
+
+# ----------------------------------------------------------------------------------------------------------------------
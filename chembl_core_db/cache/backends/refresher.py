@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import logging
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from chembl_core_db.cache.backends.processLocal import BackgroundWorkers, get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_refresher(name, workers, queue_size):
+    return get_shared('refresher', name, lambda: Refresher(workers, queue_size))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Refresher(object):
+    """
+    Small bounded thread pool running stale-while-revalidate refreshes, at most one per key at a time.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.stale_serves = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.refresh_time_total = 0.0
+        self.refresh_time_max = 0.0
+        self._queue = queue.Queue(queue_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._workers = BackgroundWorkers('cache-refresher', self._run, workers, self._reset)
+        self.log = logging.getLogger(__name__)
+
+    def record_stale(self):
+        with self._lock:
+            self.stale_serves += 1
+
+    def submit(self, key, job):
+        self._workers.ensure()
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        try:
+            self._queue.put_nowait((key, job))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(key)
+                self.dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stale_serves': self.stale_serves,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+                'refresh_time_avg': self.refresh_time_total / self.refreshes if self.refreshes else 0.0,
+                'refresh_time_max': self.refresh_time_max,
+            }
+
+    def _reset(self):
+        # refreshes pending in the parent process will never run here
+        with self._lock:
+            self._pending.clear()
+
+    def _run(self):
+        while True:
+            key, job = self._queue.get()
+            start = time.time()
+            try:
+                job()
+                failed = False
+            except Exception:
+                self.log.exception('Refreshing cache key {0} failed'.format(key))
+                failed = True
+            elapsed = time.time() - start
+            with self._lock:
+                self._pending.discard(key)
+                if failed:
+                    self.failures += 1
+                else:
+                    self.refreshes += 1
+                    self.refresh_time_total += elapsed
+                    self.refresh_time_max = max(self.refresh_time_max, elapsed)
+
+# ----------------------------------------------------------------------------------------------------------------------
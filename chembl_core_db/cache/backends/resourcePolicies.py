@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import threading
+import time
+from collections import defaultdict
+from chembl_core_db.cache.backends.processLocal import PeriodicTask, get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_resource_policies(name, policies, interval):
+    return get_shared('resource_policies', name, lambda: ResourcePolicies(name, policies, interval))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ResourcePolicies(object):
+    """
+    Per resource_name settings from OPTIONS['RESOURCE_POLICIES']: a default TIMEOUT, a MAX_ENTRY_SIZE above which
+    values are not cached and a byte QUOTA. Quotas are enforced every `interval` seconds by a background thread, so
+    requests never wait for an eviction.
+    """
+
+    def __init__(self, name, policies, interval):
+        self.name = name
+        self.policies = policies
+        self.interval = interval
+        self.quotas = dict((resource_name, policy['QUOTA']) for resource_name, policy in policies.items()
+                           if policy.get('QUOTA'))
+        self.runs = 0
+        self.last_run = None
+        self._usage = {}
+        self._rejected = defaultdict(int)
+        self._evicted = defaultdict(int)
+        self._evicted_bytes = defaultdict(int)
+        self._lock = threading.Lock()
+        self._enforcer = PeriodicTask('cache-quotas', interval)
+
+    def get(self, resource_name):
+        return self.policies.get(resource_name) or {}
+
+    def record_rejected(self, resource_name):
+        with self._lock:
+            self._rejected[resource_name] += 1
+
+    def record_evicted(self, resource_name, count, size):
+        with self._lock:
+            self._evicted[resource_name] += count
+            self._evicted_bytes[resource_name] += size
+
+    def record_usage(self, usage):
+        with self._lock:
+            self._usage = usage
+            self.runs += 1
+            self.last_run = time.time()
+
+    def stats(self):
+        with self._lock:
+            return dict((resource_name, {'quota': self.quotas.get(resource_name),
+                                         'size': self._usage.get(resource_name),
+                                         'rejected': self._rejected[resource_name],
+                                         'evicted': self._evicted[resource_name],
+                                         'evicted_bytes': self._evicted_bytes[resource_name]})
+                        for resource_name in self.policies)
+
+    def start(self, enforce):
+        if self.quotas:
+            self._enforcer.start(enforce)
+
+# ----------------------------------------------------------------------------------------------------------------------
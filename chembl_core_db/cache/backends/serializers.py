@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import json
+import struct
+import time
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from django.core.exceptions import ImproperlyConfigured
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Payloads are stored as: MAGIC, serializer id, codec id, body.
+# Pickles written with protocol >= 2 start with 0x80 and legacy compressed entries are base64 text, so the magic byte
+# is enough to tell the formats apart.
+MAGIC = b'\xcb'
+HEADER = struct.Struct('>cBB')
+HEADER_SIZE = HEADER.size
+
+# CPU time of the calling thread where available (python 3.7+), wall clock time otherwise
+_clock = getattr(time, 'thread_time', time.time)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class PickleSerializer(object):
+    id = 1
+    name = 'pickle'
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class JSONSerializer(object):
+    id = 2
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class MsgPackSerializer(object):
+    id = 3
+    name = 'msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImproperlyConfigured("Error loading msgpack module: %s" % e)
+        self.msgpack = msgpack
+
+    def dumps(self, value):
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class NoneCodec(object):
+    id = 0
+    name = 'none'
+    default_level = None
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ZlibCodec(NoneCodec):
+    id = 1
+    name = 'zlib'
+    default_level = 6
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class LZ4Codec(NoneCodec):
+    id = 2
+    name = 'lz4'
+    default_level = 0
+
+    def __init__(self, level=None):
+        super(LZ4Codec, self).__init__(level)
+        try:
+            import lz4.frame
+        except ImportError as e:
+            raise ImproperlyConfigured("Error loading lz4 module: %s" % e)
+        self.lz4 = lz4.frame
+
+    def compress(self, data):
+        return self.lz4.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        return self.lz4.decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ZstdCodec(NoneCodec):
+    id = 3
+    name = 'zstd'
+    default_level = 3
+
+    def __init__(self, level=None):
+        super(ZstdCodec, self).__init__(level)
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImproperlyConfigured("Error loading zstandard module: %s" % e)
+        self.compressor = zstandard.ZstdCompressor(level=self.level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+SERIALIZERS = dict((cls.name, cls) for cls in (PickleSerializer, JSONSerializer, MsgPackSerializer))
+SERIALIZERS_BY_ID = dict((cls.id, cls) for cls in SERIALIZERS.values())
+
+CODECS = dict((cls.name, cls) for cls in (NoneCodec, ZlibCodec, LZ4Codec, ZstdCodec))
+CODECS_BY_ID = dict((cls.id, cls) for cls in CODECS.values())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_serializer(name):
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ImproperlyConfigured("Unknown cache serializer '%s', choose one of: %s"
+                                   % (name, ', '.join(sorted(SERIALIZERS))))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_codec(name, level=None):
+    try:
+        cls = CODECS[name]
+    except KeyError:
+        raise ImproperlyConfigured("Unknown cache codec '%s', choose one of: %s" % (name, ', '.join(sorted(CODECS))))
+    return cls(cls.default_level if level is None else level)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Pipeline(object):
+    """
+    Serializes and compresses cache values, prefixing the result with a header naming the serializer and codec used,
+    so entries written with different settings can still be read back.
+
+    Compression is decided per value: values smaller than `min_size` are stored as they are, and so are values that
+    do not shrink to at most `max_ratio` of their size. For values larger than twice `sample_size` that is judged on
+    a sample first, so already compressed data (PNG images) costs one small compression instead of a full one.
+    """
+
+    def __init__(self, serializer, codec, min_size=0, sample_size=0, max_ratio=1.0):
+        self.serializer = serializer
+        self.codec = codec
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+        self._header = HEADER.pack(MAGIC, serializer.id, codec.id)
+        self._plain_header = HEADER.pack(MAGIC, serializer.id, NoneCodec.id)
+        self._serializers = {serializer.id: serializer}
+        self._codecs = {codec.id: codec, NoneCodec.id: NoneCodec()}
+
+    def dumps(self, value):
+        return self.encode(value)[0]
+
+    def encode(self, value):
+        # returns the payload, the serialized size, whether it was compressed and the time spent compressing
+        body = self.serializer.dumps(value)
+        if self.codec.id == NoneCodec.id or len(body) < self.min_size:
+            return self._plain_header + body, len(body), False, 0.0
+        start = _clock()
+        compressed = None
+        if self._worth_compressing(body):
+            compressed = self.codec.compress(body)
+        elapsed = _clock() - start
+        if compressed is None or len(compressed) > len(body) * self.max_ratio:
+            return self._plain_header + body, len(body), False, elapsed
+        return self._header + compressed, len(body), True, elapsed
+
+    def _worth_compressing(self, body):
+        if not self.sample_size or len(body) <= 2 * self.sample_size:
+            return True
+        sample = body[:self.sample_size]
+        return len(self.codec.compress(sample)) <= len(sample) * self.max_ratio
+
+    def loads(self, data):
+        serializer, body = self.unpack(data)
+        return serializer.loads(body)
+
+    def unpack(self, data):
+        data = bytes(data)
+        magic, serializer_id, codec_id = HEADER.unpack(data[:HEADER_SIZE])
+        if magic != MAGIC:
+            raise ValueError('Not a cache payload')
+        return self._get_serializer(serializer_id), self._get_codec(codec_id).decompress(data[HEADER_SIZE:])
+
+    def is_payload(self, data):
+        return isinstance(data, bytes) and data[:1] == MAGIC
+
+    def _get_serializer(self, serializer_id):
+        if serializer_id not in self._serializers:
+            self._serializers[serializer_id] = SERIALIZERS_BY_ID[serializer_id]()
+        return self._serializers[serializer_id]
+
+    def _get_codec(self, codec_id):
+        if codec_id not in self._codecs:
+            cls = CODECS_BY_ID[codec_id]
+            self._codecs[codec_id] = cls(cls.default_level)
+        return self._codecs[codec_id]
+
+# ----------------------------------------------------------------------------------------------------------------------
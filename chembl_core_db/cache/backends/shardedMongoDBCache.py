@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import logging
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+from chembl_core_db.cache.backends.MongoDBCache import MongoDBCache
+from chembl_core_db.cache.backends.hashRing import HashRing
+from chembl_core_db.cache.backends.processLocal import BackgroundWorkers, get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _Job(object):
+
+    def __init__(self, call, shard, arg):
+        self.call = call
+        self.shard = shard
+        self.arg = arg
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        # a job is run by whichever of the calling thread and the workers gets to it first
+        with self._lock:
+            if self._claimed:
+                return
+            self._claimed = True
+        try:
+            self.result = self.call(self.shard, self.arg)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done.set()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ShardWorkers(object):
+    """
+    Threads shared by the backend instances of one sharded cache, fanning multi-key calls out to the shards. The
+    calling thread runs the first job itself, and any job no worker has picked up by the time it is done.
+    """
+
+    def __init__(self, count):
+        self._queue = queue.Queue()
+        self._workers = BackgroundWorkers('cache-shard', self._run, count, self._reset)
+
+    def run(self, jobs):
+        self._workers.ensure()
+        for job in jobs[1:]:
+            self._queue.put(job)
+        for job in jobs:
+            job.run()
+        for job in jobs:
+            job.done.wait()
+
+    def _reset(self):
+        self._queue = queue.Queue()
+
+    def _run(self):
+        while True:
+            self._queue.get().run()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ShardedMongoDBCache(BaseCache):
+    """
+    Spreads keys over several MongoDBCache deployments with a consistent hash ring.
+
+    OPTIONS['SHARDS'] is a list of dicts overriding the remaining OPTIONS for each deployment (HOST, RSNAME,
+    DATABASE, ...), optionally with a NAME (its position on the ring, defaults to HOST/DATABASE) and a WEIGHT.
+    OPTIONS['SHARD_WORKERS'] is the number of threads per process fanning multi-key calls out to the shards
+    (defaults to one less than the number of shards, as the calling thread takes one shard itself).
+
+    A shard failing in a multi-key call does not fail the call: get_many returns the keys of the healthy shards and
+    set_many reports the keys of the failed shard as not set.
+    """
+
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        if not options.get('SHARDS'):
+            raise ImproperlyConfigured('ShardedMongoDBCache needs a non-empty SHARDS list in OPTIONS')
+        shared = dict((k, v) for k, v in options.items() if k not in ('SHARDS', 'VIRTUAL_NODES', 'SHARD_WORKERS'))
+        self.shards = OrderedDict()
+        weights = {}
+        for shard in options['SHARDS']:
+            shard_options = dict(shared)
+            shard_options.update(shard)
+            name = shard_options.pop('NAME', None) or '{0}/{1}'.format(shard_options.get('HOST', 'localhost'),
+                                                                       shard_options.get('DATABASE', 'django_cache'))
+            weights[name] = shard_options.pop('WEIGHT', 1)
+            shard_params = dict(params)
+            shard_params['OPTIONS'] = shard_options
+            self.shards[name] = MongoDBCache(location, shard_params)
+        self.ring = HashRing(weights, options.get('VIRTUAL_NODES', 160))
+        workers = options.get('SHARD_WORKERS', max(len(self.shards) - 1, 1))
+        self.workers = get_shared('shard_workers', location, lambda: ShardWorkers(workers))
+        self.log = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_shard(self, key, version=None):
+        return self.shards[self.ring.get_node(self.make_key(key, version))]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _group(self, keys, version):
+        groups = defaultdict(list)
+        for key in keys:
+            groups[self.ring.get_node(self.make_key(key, version))].append(key)
+        return [(self.shards[name], group) for name, group in groups.items()]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _parallel(self, jobs, call, on_error=None):
+        # with `on_error`, the result of a failed shard is on_error(shard, arg) instead of the error being raised
+        jobs = [_Job(call, shard, arg) for shard, arg in jobs]
+        if len(jobs) == 1:
+            jobs[0].run()
+        else:
+            self.workers.run(jobs)
+        results = []
+        for job in jobs:
+            if job.error is not None:
+                if on_error is None:
+                    six.reraise(*job.error)
+                self.log.warning('Cache shard call failed', exc_info=job.error)
+                results.append(on_error(job.shard, job.arg))
+            else:
+                results.append(job.result)
+        return results
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.get_shard(key, version).add(key, value, timeout, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.get_shard(key, version).set(key, value, timeout, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        return self.get_shard(key, version).get(key, default, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.get_shard(key, version).get_or_set(key, default, timeout, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def has_key(self, key, version=None):
+        return self.get_shard(key, version).has_key(key, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def delete(self, key, version=None):
+        self.get_shard(key, version).delete(key, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def incr(self, key, delta=1, version=None):
+        return self.get_shard(key, version).incr(key, delta, version)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_many(self, keys, version=None):
+        out = {}
+        for result in self._parallel(self._group(keys, version), lambda shard, group: shard.get_many(group, version),
+                                     lambda shard, group: {}):
+            out.update(result)
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = []
+        jobs = self._group(data, version)
+        for result in self._parallel(jobs, lambda shard, group: shard.set_many(
+                dict((key, data[key]) for key in group), timeout, version), lambda shard, group: list(group)):
+            failed.extend(result)
+        return failed
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def delete_many(self, keys, version=None):
+        self._parallel(self._group(keys, version), lambda shard, group: shard.delete_many(group, version))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def incr_many(self, deltas, timeout=DEFAULT_TIMEOUT, version=None, return_values=True):
+        if not isinstance(deltas, dict):
+            deltas = dict((key, 1) for key in deltas)
+        results = self._parallel(self._group(deltas, version), lambda shard, group: shard.incr_many(
+            dict((key, deltas[key]) for key in group), timeout, version, return_values))
+        if not return_values:
+            return None
+        out = {}
+        for result in results:
+            out.update(result)
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _all_shards(self, call):
+        return self._parallel([(shard, None) for shard in self.shards.values()], lambda shard, _: call(shard))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def clear(self):
+        self._all_shards(lambda shard: shard.clear())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def delete_by(self, resource_name=None, **props):
+        return sum(self._all_shards(lambda shard: shard.delete_by(resource_name, **props)))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        self._all_shards(lambda shard: shard.flush())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def stats_by_resource(self):
+        out = {}
+        for stats in self._all_shards(lambda shard: shard.stats_by_resource()):
+            for resource_name, row in stats.items():
+                merged = out.setdefault(resource_name, {'count': 0, 'size': 0, 'max_size': 0})
+                merged['count'] += row['count']
+                merged['size'] += row['size']
+                merged['max_size'] = max(merged['max_size'], row['max_size'])
+        return out
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def shard_stats(self):
+        # per shard counters of the optional near cache, refresher and write-behind buffer, and of compression
+        return dict((name, {'near_cache': shard.near_cache_stats(), 'stale': shard.stale_stats(),
+                            'write_behind': shard.write_behind_stats(),
+                            'compression': shard.compression_stats(), 'quotas': shard.quota_stats()})
+                    for name, shard in self.shards.items())
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from chembl_core_db.cache.backends.processLocal import BackgroundWorkers, get_shared
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _create_write_buffer(writer, max_size, batch_size, interval, drop_oldest):
+    write_buffer = WriteBuffer(writer, max_size, batch_size, interval, drop_oldest)
+    atexit.register(write_buffer.flush)
+    return write_buffer
+
+
+def get_write_buffer(name, writer, max_size, batch_size, interval, drop_oldest):
+    return get_shared('write_buffer', name, lambda: _create_write_buffer(writer, max_size, batch_size, interval,
+                                                                         drop_oldest))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class WriteBuffer(object):
+    """
+    Bounded, per-process buffer of pending cache writes. Writes to the same key are coalesced and a background thread
+    hands them to `writer` in batches, whenever `batch_size` writes are waiting or `interval` seconds have passed.
+    """
+
+    def __init__(self, writer, max_size, batch_size, interval, drop_oldest):
+        self.writer = writer
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.drop_oldest = drop_oldest
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = BackgroundWorkers('cache-write-behind', self._run)
+        self.log = logging.getLogger(__name__)
+
+    def put(self, key, operation, replace=True):
+        # with replace=False a write already pending for the key is kept and the new one refused
+        self._flusher.ensure()
+        with self._lock:
+            if key in self._pending:
+                if not replace:
+                    return False
+                del self._pending[key]
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_size:
+                self.dropped += 1
+                if not self.drop_oldest:
+                    return False
+                self._pending.popitem(last=False)
+            self._pending[key] = operation
+            self.enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._pending.get(key)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = []
+                    while self._pending and len(batch) < self.batch_size:
+                        batch.append(self._pending.popitem(last=False))
+                if not batch:
+                    return
+                start = time.time()
+                try:
+                    self.writer(batch)
+                    failed = False
+                except Exception:
+                    self.log.exception('Flushing {0} buffered cache writes failed'.format(len(batch)))
+                    failed = True
+                elapsed = time.time() - start
+                with self._lock:
+                    self.flushes += 1
+                    if failed:
+                        self.failures += 1
+                    else:
+                        self.flushed += len(batch)
+                    self.flush_time_total += elapsed
+                    self.flush_time_max = max(self.flush_time_max, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': len(self._pending),
+                'enqueued': self.enqueued,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+                'flushed': self.flushed,
+                'failures': self.failures,
+                'flush_time_avg': self.flush_time_total / self.flushes if self.flushes else 0.0,
+                'flush_time_max': self.flush_time_max,
+            }
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -7,11 +7,15 @@ from __future__ import unicode_literals
 
 import datetime
 import decimal
+import logging
 import os
 import platform
 import sys
+import threading
 import warnings
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import timedelta
 
 from django.conf import settings
@@ -68,6 +72,8 @@ from .utils import Oracle_datetime, convert_unicode         # isort:skip
 DatabaseError = Database.DatabaseError
 IntegrityError = Database.IntegrityError
 
+logger = logging.getLogger('chembl_core_db.db.backends')
+
 
 class _UninitializedOperatorsDescriptor(object):
 
@@ -186,68 +192,91 @@ class DatabaseWrapper(BaseDatabaseWrapper):
     introspection_class = DatabaseIntrospection
     ops_class = DatabaseOperations
 
+    # OPTIONS used by the backend itself, not passed to Database.connect().
+    backend_options = ('use_returning_into', 'native_numbers', 'arraysize', 'prefetchrows', 'adaptive_arraysize',
+                       'max_arraysize', 'pool')
+
     def __init__(self, *args, **kwargs):
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
-        use_returning_into = self.settings_dict["OPTIONS"].get('use_returning_into', True)
+        options = self.settings_dict["OPTIONS"]
+        use_returning_into = options.get('use_returning_into', True)
         self.features.can_return_id_from_insert = use_returning_into
-
-    def _connect_string(self):
+        # Fetch NUMBER columns as native Python numbers through an output
+        # type handler instead of as strings parsed in Python.
+        self.native_numbers = options.get('native_numbers', False)
+        # Default arraysize of 1 is highly sub-optimal.
+        self.arraysize = options.get('arraysize', 100)
+        self.prefetchrows = options.get('prefetchrows', None)
+        # Shared by all threads, sizes are learnt per statement.
+        self.fetch_advisor = get_fetch_advisor(self.alias, options.get('adaptive_arraysize', False),
+                                               self.arraysize, options.get('max_arraysize', 10000))
+        self._fetch_size_override = None
+        # Process-wide session pool settings, see SessionPool.
+        self.pool_options = options.get('pool', None)
+        self._session_initialised = False
+
+    def _dsn(self):
         settings_dict = self.settings_dict
         if not settings_dict['HOST'].strip():
             settings_dict['HOST'] = 'localhost'
         if settings_dict['PORT'].strip():
-            dsn = Database.makedsn(settings_dict['HOST'],
-                                   int(settings_dict['PORT']),
-                                   settings_dict['NAME'])
-        else:
-            dsn = settings_dict['NAME']
+            return Database.makedsn(settings_dict['HOST'],
+                                    int(settings_dict['PORT']),
+                                    settings_dict['NAME'])
+        return settings_dict['NAME']
+
+    def _connect_string(self):
+        settings_dict = self.settings_dict
         return "%s/%s@%s" % (settings_dict['USER'],
-                             settings_dict['PASSWORD'], dsn)
+                             settings_dict['PASSWORD'], self._dsn())
 
     def get_connection_params(self):
         conn_params = self.settings_dict['OPTIONS'].copy()
-        if 'use_returning_into' in conn_params:
-            del conn_params['use_returning_into']
+        for option in self.backend_options:
+            conn_params.pop(option, None)
         return conn_params
 
     def get_new_connection(self, conn_params):
+        if self.pool_options is not None:
+            # Closing a pooled connection releases the session to the pool.
+            pool = get_session_pool(self.alias, convert_unicode(self.settings_dict['USER']),
+                                    convert_unicode(self.settings_dict['PASSWORD']), convert_unicode(self._dsn()),
+                                    self.pool_options, conn_params)
+            self._session_initialised = pool.initialises_sessions
+            return pool.acquire()
+        self._session_initialised = False
         conn_string = convert_unicode(self._connect_string())
         return Database.connect(conn_string, **conn_params)
 
     def init_connection_state(self):
-        cursor = self.create_cursor()
-        # Set the territory first. The territory overrides NLS_DATE_FORMAT
-        # and NLS_TIMESTAMP_FORMAT to the territory default. When all of
-        # these are set in single statement it isn't clear what is supposed
-        # to happen.
-        cursor.execute("ALTER SESSION SET NLS_TERRITORY = 'AMERICA'")
-        # Set Oracle date to ANSI date format.  This only needs to execute
-        # once when we create a new connection. We also set the Territory
-        # to 'AMERICA' which forces Sunday to evaluate to a '1' in
-        # TO_CHAR().
-        cursor.execute(
-            "ALTER SESSION SET NLS_DATE_FORMAT = 'YYYY-MM-DD HH24:MI:SS'"
-            " NLS_TIMESTAMP_FORMAT = 'YYYY-MM-DD HH24:MI:SS.FF'"
-            + (" TIME_ZONE = 'UTC'" if settings.USE_TZ else ''))
-        cursor.close()
+        if not self._session_initialised:
+            _init_session(self.connection)
         if 'operators' not in self.__dict__:
             # Ticket #14149: Check whether our LIKE implementation will
             # work for this connection or we need to fall back on LIKEC.
-            # This check is performed only once per DatabaseWrapper
-            # instance per thread, since subsequent connections will use
-            # the same settings.
-            cursor = self.create_cursor()
-            try:
-                cursor.execute("SELECT 1 FROM DUAL WHERE DUMMY %s"
-                               % self._standard_operators['contains'],
-                               ['X'])
-            except DatabaseError:
+            # The result depends only on the database, so the check is
+            # performed once per user and DSN per process; connections
+            # opened later, in any thread, reuse it.
+            key = (self.settings_dict['USER'], self._dsn())
+            likec = _likec_databases.get(key)
+            if likec is None:
+                cursor = self.create_cursor()
+                try:
+                    cursor.execute("SELECT 1 FROM DUAL WHERE DUMMY %s"
+                                   % self._standard_operators['contains'],
+                                   ['X'])
+                except DatabaseError:
+                    likec = True
+                else:
+                    likec = False
+                cursor.close()
+                _likec_databases[key] = likec
+            if likec:
                 self.operators = self._likec_operators
                 self.pattern_ops = self._likec_pattern_ops
             else:
                 self.operators = self._standard_operators
                 self.pattern_ops = self._standard_pattern_ops
-            cursor.close()
 
         try:
             self.connection.stmtcachesize = 20
@@ -260,7 +289,41 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             self.commit()
 
     def create_cursor(self, name=None):
-        return FormatStylePlaceholderCursor(self.connection)
+        if self._fetch_size_override is not None:
+            arraysize, prefetchrows = self._fetch_size_override
+            return FormatStylePlaceholderCursor(self.connection, self.native_numbers, arraysize, prefetchrows,
+                                                FetchAdvisor(False, arraysize, arraysize, self.fetch_advisor))
+        return FormatStylePlaceholderCursor(self.connection, self.native_numbers, self.arraysize, self.prefetchrows,
+                                            self.fetch_advisor)
+
+    @contextmanager
+    def fetch_size(self, arraysize, prefetchrows=None):
+        """
+        Fetch size for the queries run inside the block, e.g. for a bulk
+        export:
+
+            with connections['default'].fetch_size(5000):
+                for activity in Activities.objects.iterator():
+                    ...
+        """
+        previous = self._fetch_size_override
+        self._fetch_size_override = (arraysize, prefetchrows)
+        try:
+            yield
+        finally:
+            self._fetch_size_override = previous
+
+    def fetch_stats(self):
+        return self.fetch_advisor.stats()
+
+    def pool_stats(self):
+        if self.pool_options is None:
+            return None
+        # None until the first connection has opened the pool of this process.
+        pool = _session_pools.get(self.alias)
+        if pool is None or pool.pid != os.getpid():
+            return None
+        return pool.stats()
 
     def _commit(self):
         if self.connection is not None:
@@ -322,6 +385,117 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             return None
 
 
+# Outcome of the LIKE check in init_connection_state, keyed by (user, dsn).
+_likec_databases = {}
+
+
+def _init_session(connection):
+    # Both ALTER SESSION statements are sent in one anonymous PL/SQL
+    # block, so a new session costs a single round trip.
+    # Set the territory first. The territory overrides NLS_DATE_FORMAT
+    # and NLS_TIMESTAMP_FORMAT to the territory default. When all of
+    # these are set in single statement it isn't clear what is supposed
+    # to happen.
+    # Set Oracle date to ANSI date format.  This only needs to execute
+    # once when we create a new connection. We also set the Territory
+    # to 'AMERICA' which forces Sunday to evaluate to a '1' in
+    # TO_CHAR().
+    cursor = connection.cursor()
+    cursor.execute(
+        "BEGIN"
+        " EXECUTE IMMEDIATE 'ALTER SESSION SET NLS_TERRITORY = ''AMERICA''';"
+        " EXECUTE IMMEDIATE 'ALTER SESSION SET"
+        " NLS_DATE_FORMAT = ''YYYY-MM-DD HH24:MI:SS'''"
+        " || ' NLS_TIMESTAMP_FORMAT = ''YYYY-MM-DD HH24:MI:SS.FF'''"
+        + (" || ' TIME_ZONE = ''UTC'''" if settings.USE_TZ else '') +
+        "; END;")
+    cursor.close()
+
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(alias, user, password, dsn, options, conn_params):
+    with _session_pools_lock:
+        pool = _session_pools.get(alias)
+        # Sessions of the parent cannot be used after a fork.
+        if pool is None or pool.pid != os.getpid():
+            pool = SessionPool(user, password, dsn, options, conn_params)
+            _session_pools[alias] = pool
+        return pool
+
+
+class SessionPool(object):
+    """
+    Process-wide cx_Oracle session pool of one database alias, configured by
+    OPTIONS['pool']: min, max, increment, timeout (seconds a session may stay
+    idle), getmode ('wait', 'nowait' or 'forceget') and, for DRCP, cclass and
+    purity ('default', 'new' or 'self'). The connection parameters
+    (threaded, encoding, nencoding, events...) are passed to the pool.
+
+    Sessions are tagged once their state (NLS settings, time zone) has been
+    initialised by the session callback, so connections acquired later skip
+    the ALTER SESSION statements. Drivers without session callbacks
+    (cx_Oracle < 7) initialise every acquired session instead.
+    """
+    tag = 'chembl_core_db'
+    getmodes = {'wait': 'SPOOL_ATTRVAL_WAIT', 'nowait': 'SPOOL_ATTRVAL_NOWAIT', 'forceget': 'SPOOL_ATTRVAL_FORCEGET'}
+    purities = {'default': 'ATTR_PURITY_DEFAULT', 'new': 'ATTR_PURITY_NEW', 'self': 'ATTR_PURITY_SELF'}
+
+    def __init__(self, user, password, dsn, options, conn_params):
+        self.cclass = options.get('cclass')
+        self.purity = getattr(Database, self.purities[options['purity']]) if options.get('purity') else None
+        self.acquired = 0
+        self.sessions_initialised = 0
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        kwargs = dict(conn_params)
+        kwargs.setdefault('threaded', True)
+        kwargs.update(min=options.get('min', 1), max=options.get('max', 4), increment=options.get('increment', 1),
+                      getmode=getattr(Database, self.getmodes[options.get('getmode', 'wait')]))
+        try:
+            self.pool = Database.SessionPool(user, password, dsn, sessionCallback=self._init_session, **kwargs)
+            self.initialises_sessions = True
+        except TypeError:
+            self.pool = Database.SessionPool(user, password, dsn, **kwargs)
+            self.initialises_sessions = False
+        if options.get('timeout'):
+            self.pool.timeout = options['timeout']
+
+    def _init_session(self, connection, requested_tag):
+        _init_session(connection)
+        connection.tag = requested_tag
+        with self._lock:
+            self.sessions_initialised += 1
+
+    def acquire(self):
+        kwargs = {}
+        if self.cclass:
+            kwargs['cclass'] = self.cclass
+        if self.purity is not None:
+            kwargs['purity'] = self.purity
+        if self.initialises_sessions:
+            kwargs['tag'] = self.tag
+        connection = self.pool.acquire(**kwargs)
+        with self._lock:
+            self.acquired += 1
+        return connection
+
+    def stats(self):
+        with self._lock:
+            return {
+                'opened': self.pool.opened,
+                'busy': self.pool.busy,
+                'min': self.pool.min,
+                'max': self.pool.max,
+                'increment': self.pool.increment,
+                'timeout': self.pool.timeout,
+                'acquired': self.acquired,
+                'sessions_initialised': self.sessions_initialised,
+            }
+
+
 class OracleParam(object):
     """
     Wrapper object for formatting parameters for Oracle. If the string
@@ -403,6 +577,82 @@ class VariableWrapper(object):
             setattr(self.var, key, value)
 
 
+_fetch_advisors = {}
+_fetch_advisors_lock = threading.Lock()
+
+
+def get_fetch_advisor(alias, adaptive, arraysize, max_arraysize):
+    with _fetch_advisors_lock:
+        advisor = _fetch_advisors.get(alias)
+        if advisor is None:
+            advisor = FetchAdvisor(adaptive, arraysize, max_arraysize)
+            _fetch_advisors[alias] = advisor
+        return advisor
+
+
+class FetchAdvisor(object):
+    """
+    Counts rows and estimated network round trips of executed statements. In
+    adaptive mode it also remembers how many rows each statement returned,
+    so the next execution fetches them with an arraysize grown to fit (up to
+    `max_arraysize`). Sizes only apply from the next execute, the driver
+    allocates its fetch buffers there. The arraysize never drops below the
+    configured one: the same SQL text returns one row or thousands depending
+    on its bind parameters.
+    """
+    max_statements = 1000
+
+    def __init__(self, adaptive, arraysize, max_arraysize, parent=None):
+        self.adaptive = adaptive
+        self.arraysize = arraysize
+        self.max_arraysize = max_arraysize
+        # Counters of a temporary advisor (fetch_size()) go to the parent.
+        self.parent = parent
+        self.statements = 0
+        self.rows = 0
+        self.round_trips = 0
+        self._sizes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def arraysize_for(self, query):
+        if not self.adaptive:
+            return self.arraysize
+        with self._lock:
+            return self._sizes.get(query, self.arraysize)
+
+    def record(self, query, rows, arraysize):
+        if self.parent is not None:
+            return self.parent.record(query, rows, arraysize)
+        # One round trip for the execute, one per arraysize rows after it.
+        round_trips = 1 + (rows + arraysize - 1) // arraysize
+        with self._lock:
+            self.statements += 1
+            self.rows += rows
+            self.round_trips += round_trips
+            if self.adaptive:
+                size = self.arraysize
+                while size <= rows and size < self.max_arraysize:
+                    size *= 2
+                # Re-inserted to keep the most recently run statements.
+                self._sizes.pop(query, None)
+                self._sizes[query] = min(size, self.max_arraysize)
+                while len(self._sizes) > self.max_statements:
+                    self._sizes.popitem(last=False)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%d rows in %d round trips (arraysize %d): %s', rows, round_trips, arraysize, query)
+        return round_trips
+
+    def stats(self):
+        with self._lock:
+            return {
+                'statements': self.statements,
+                'rows': self.rows,
+                'round_trips': self.round_trips,
+                'round_trips_per_statement': float(self.round_trips) / self.statements if self.statements else None,
+                'learnt_statements': len(self._sizes),
+            }
+
+
 class FormatStylePlaceholderCursor(object):
     """
     Django uses "format" (e.g. '%s') style placeholders, but Oracle uses ":var"
@@ -414,12 +664,41 @@ class FormatStylePlaceholderCursor(object):
     """
     charset = 'utf-8'
 
-    def __init__(self, connection):
+    def __init__(self, connection, native_numbers=False, arraysize=100, prefetchrows=None, advisor=None):
         self.cursor = connection.cursor()
-        # Necessary to retrieve decimal values without rounding error.
-        self.cursor.numbersAsStrings = True
+        self.native_numbers = native_numbers
+        if native_numbers:
+            self.cursor.outputtypehandler = _output_type_handler
+        else:
+            # Necessary to retrieve decimal values without rounding error.
+            self.cursor.numbersAsStrings = True
         # Default arraysize of 1 is highly sub-optimal.
-        self.cursor.arraysize = 100
+        self.cursor.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+        self.advisor = advisor
+        # Row converter of the last executed statement, built on first fetch.
+        self._convert = None
+        # Statement being fetched and rows fetched so far, for the advisor.
+        self._query = None
+        self.rows_fetched = 0
+
+    def _start_statement(self, query):
+        self._finish_statement()
+        self._convert = None
+        if self.advisor is None:
+            return
+        self._query = query
+        # Fetch buffers are allocated on execute, so sizes must be set before.
+        self.cursor.arraysize = self.advisor.arraysize_for(query)
+        if self.prefetchrows is not None and hasattr(self.cursor, 'prefetchrows'):
+            # cx_Oracle 8 and later.
+            self.cursor.prefetchrows = self.prefetchrows
+
+    def _finish_statement(self):
+        if self._query is not None:
+            self.advisor.record(self._query, self.rows_fetched, self.cursor.arraysize)
+        self._query = None
+        self.rows_fetched = 0
 
     def _format_params(self, params):
         try:
@@ -475,6 +754,7 @@ class FormatStylePlaceholderCursor(object):
     def execute(self, query, params=None):
         query, params = self._fix_for_params(query, params)
         self._guess_input_sizes([params])
+        self._start_statement(query)
         #print query
         #print self._param_generator(params)
         try:
@@ -503,6 +783,8 @@ class FormatStylePlaceholderCursor(object):
         # more than once, we can't make it lazy by using a generator
         formatted = [firstparams] + [self._format_params(p) for p in params_iter]
         self._guess_input_sizes(formatted)
+        self._finish_statement()
+        self._convert = None
         try:
             return self.cursor.executemany(query,
                                 [self._param_generator(p) for p in formatted])
@@ -512,21 +794,34 @@ class FormatStylePlaceholderCursor(object):
                 six.reraise(utils.IntegrityError, utils.IntegrityError(*tuple(e.args)), sys.exc_info()[2])
             raise
 
+    def _converter(self):
+        if self._convert is None:
+            self._convert = _row_converter(self.cursor.description, self.native_numbers)
+        return self._convert
+
     def fetchone(self):
         row = self.cursor.fetchone()
         if row is None:
             return row
-        return _rowfactory(row, self.cursor)
+        self.rows_fetched += 1
+        return self._converter()(row)
 
     def fetchmany(self, size=None):
         if size is None:
             size = self.arraysize
-        return tuple(_rowfactory(r, self.cursor) for r in self.cursor.fetchmany(size))
+        convert = self._converter()
+        rows = tuple(convert(r) for r in self.cursor.fetchmany(size))
+        self.rows_fetched += len(rows)
+        return rows
 
     def fetchall(self):
-        return tuple(_rowfactory(r, self.cursor) for r in self.cursor.fetchall())
+        convert = self._converter()
+        rows = tuple(convert(r) for r in self.cursor.fetchall())
+        self.rows_fetched += len(rows)
+        return rows
 
     def close(self):
+        self._finish_statement()
         try:
             self.cursor.close()
         except Database.InterfaceError:
@@ -546,69 +841,117 @@ class FormatStylePlaceholderCursor(object):
             return getattr(self.cursor, attr)
 
     def __iter__(self):
-        return CursorIterator(self.cursor)
+        return CursorIterator(self.cursor, self._converter(), self)
 
 
 class CursorIterator(six.Iterator):
 
     """Cursor iterator wrapper that invokes our custom row factory."""
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, convert=None, owner=None):
         self.cursor = cursor
         self.iter = iter(cursor)
+        self.convert = convert or _row_converter(cursor.description)
+        # FormatStylePlaceholderCursor counting the rows fetched.
+        self.owner = owner
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return _rowfactory(next(self.iter), self.cursor)
+        row = self.convert(next(self.iter))
+        if self.owner is not None:
+            self.owner.rows_fetched += 1
+        return row
+
+
+def _int_or_decimal(value):
+    return decimal.Decimal(value) if '.' in value else int(value)
+
+
+def _make_aware(value):
+    # Confirm that dt is naive before overwriting its tzinfo.
+    if timezone.is_naive(value):
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _output_type_handler(cursor, name, default_type, length, precision, scale):
+    # Makes the driver return NUMBER columns as the types _column_converter
+    # would produce from strings: ints for integer columns, floats for FLOAT
+    # columns and Decimals only where the column can hold fractions.
+    if default_type is not Database.NUMBER:
+        return None
+    if scale == -127:
+        if precision == 0:
+            return cursor.var(Database.STRING, 255, cursor.arraysize, outconverter=_int_or_decimal)
+        return cursor.var(Database.NATIVE_FLOAT, arraysize=cursor.arraysize)
+    if precision > 0:
+        if scale == 0:
+            return cursor.var(int, arraysize=cursor.arraysize)
+        return cursor.var(Database.STRING, 255, cursor.arraysize, outconverter=decimal.Decimal)
+    return cursor.var(Database.STRING, 255, cursor.arraysize, outconverter=_int_or_decimal)
+
+
+def _column_converter(desc, native_numbers=False):
+    # Returns the callable casting non-null values of a column, or None if
+    # they are returned as they are.
+    if desc[1] is Database.NUMBER:
+        if native_numbers:
+            # Already converted by _output_type_handler.
+            return None
+        precision, scale = desc[4:6]
+        if scale == -127:
+            if precision == 0:
+                # NUMBER column: decimal-precision floating point
+                # This will normally be an integer from a sequence,
+                # but it could be a decimal value.
+                return _int_or_decimal
+            # FLOAT column: binary-precision floating point.
+            # This comes from FloatField columns.
+            return float
+        if precision > 0:
+            # NUMBER(p,s) column: decimal-precision fixed point.
+            # This comes from IntField and DecimalField columns.
+            return int if scale == 0 else decimal.Decimal
+        # No type information. This normally comes from a
+        # mathematical expression in the SELECT list. Guess int
+        # or Decimal based on whether it has a decimal point.
+        return _int_or_decimal
+    # datetimes are returned as TIMESTAMP, except the results
+    # of "dates" queries, which are returned as DATETIME.
+    if desc[1] in (Database.TIMESTAMP, Database.DATETIME):
+        return _make_aware if settings.USE_TZ else None
+    if desc[1] in (Database.STRING, Database.FIXED_CHAR, Database.LONG_STRING):
+        # cx_Oracle already returns text on Python 3.
+        return to_unicode if six.PY2 else None
+    return None
+
+
+def _row_converter(description, native_numbers=False):
+    # Cast numeric values as the appropriate Python type based upon the
+    # cursor description, and convert strings to unicode. The description
+    # is examined once per statement; rows are then only touched in the
+    # columns that need a conversion.
+    converters = tuple((i, converter)
+                       for i, converter in enumerate(_column_converter(desc, native_numbers)
+                                                     for desc in description or ())
+                       if converter is not None)
+    if not converters:
+        return tuple
+
+    def convert(row):
+        casted = list(row)
+        for i, converter in converters:
+            value = casted[i]
+            if value is not None:
+                casted[i] = converter(value)
+        return tuple(casted)
+    return convert
 
 
 def _rowfactory(row, cursor):
-    # Cast numeric values as the appropriate Python type based upon the
-    # cursor description, and convert strings to unicode.
-    casted = []
-    for value, desc in zip(row, cursor.description):
-        if value is not None and desc[1] is Database.NUMBER:
-            precision, scale = desc[4:6]
-            if scale == -127:
-                if precision == 0:
-                    # NUMBER column: decimal-precision floating point
-                    # This will normally be an integer from a sequence,
-                    # but it could be a decimal value.
-                    if '.' in value:
-                        value = decimal.Decimal(value)
-                    else:
-                        value = int(value)
-                else:
-                    # FLOAT column: binary-precision floating point.
-                    # This comes from FloatField columns.
-                    value = float(value)
-            elif precision > 0:
-                # NUMBER(p,s) column: decimal-precision fixed point.
-                # This comes from IntField and DecimalField columns.
-                if scale == 0:
-                    value = int(value)
-                else:
-                    value = decimal.Decimal(value)
-            elif '.' in value:
-                # No type information. This normally comes from a
-                # mathematical expression in the SELECT list. Guess int
-                # or Decimal based on whether it has a decimal point.
-                value = decimal.Decimal(value)
-            else:
-                value = int(value)
-        # datetimes are returned as TIMESTAMP, except the results
-        # of "dates" queries, which are returned as DATETIME.
-        elif desc[1] in (Database.TIMESTAMP, Database.DATETIME):
-            # Confirm that dt is naive before overwriting its tzinfo.
-            if settings.USE_TZ and value is not None and timezone.is_naive(value):
-                value = value.replace(tzinfo=timezone.utc)
-        elif desc[1] in (Database.STRING, Database.FIXED_CHAR,
-                         Database.LONG_STRING):
-            value = to_unicode(value)
-        casted.append(value)
-    return tuple(casted)
+    return _row_converter(cursor.description)(row)
 
 
 def to_unicode(s):
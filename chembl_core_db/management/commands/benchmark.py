@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import base64
+import datetime
+import decimal
+import random
+import time
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache.backends.base import BaseCache
+from django.core.management.base import BaseCommand, CommandError
+from chembl_core_db.cache.backends.MongoDBCache import MongoDBCache
+from chembl_core_db.cache.backends.serializers import CODECS, SERIALIZERS, Pipeline, get_codec, get_serializer
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def payload(i):
+    # shaped like a tastypie molecule resource, about 1.5KB once pickled
+    return {
+        'molecule_chembl_id': 'CHEMBL{0}'.format(i),
+        'pref_name': 'COMPOUND {0}'.format(i) if i % 3 else None,
+        'max_phase': i % 5,
+        'molecule_type': 'Small molecule',
+        'molecule_properties': dict(('prop_{0}'.format(j), '{0:.2f}'.format((i * 7 + j) % 1000 / 3.0))
+                                    for j in range(20)),
+        'molecule_structures': {
+            'canonical_smiles': 'CC(=O)Oc1ccccc1C(=O)O' * (1 + i % 4),
+            'standard_inchi_key': 'BSYNRYMUTXBXSQ-UHFFFAOYSA-{0}'.format(i % 26),
+        },
+        'molecule_synonyms': [{'synonyms': 'SYNONYM {0}-{1}'.format(i, j), 'syn_type': 'TRADE_NAME'}
+                              for j in range(i % 6)],
+        'resource_uri': '/chembl/api/data/molecule/CHEMBL{0}'.format(i),
+    }
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _legacy_rowfactory(base, row, cursor):
+    # the per-row conversion of the oracleChEmbl backend before converter plans, kept as the baseline
+    Database = base.Database
+    casted = []
+    for value, desc in zip(row, cursor.description):
+        if value is not None and desc[1] is Database.NUMBER:
+            precision, scale = desc[4:6]
+            if scale == -127:
+                if precision == 0:
+                    if '.' in value:
+                        value = decimal.Decimal(value)
+                    else:
+                        value = int(value)
+                else:
+                    value = float(value)
+            elif precision > 0:
+                if scale == 0:
+                    value = int(value)
+                else:
+                    value = decimal.Decimal(value)
+            elif '.' in value:
+                value = decimal.Decimal(value)
+            else:
+                value = int(value)
+        elif desc[1] in (Database.TIMESTAMP, Database.DATETIME):
+            if settings.USE_TZ and value is not None and timezone.is_naive(value):
+                value = value.replace(tzinfo=timezone.utc)
+        elif desc[1] in (Database.STRING, Database.FIXED_CHAR, Database.LONG_STRING):
+            value = base.to_unicode(value)
+        casted.append(value)
+    return tuple(casted)
+
+
+def page(i, limit=20):
+    # a page of a tastypie list view
+    return {'meta': {'limit': limit, 'offset': i * limit, 'total_count': 1900000,
+                     'next': '/chembl/api/data/molecule.json?limit={0}&offset={1}'.format(limit, (i + 1) * limit),
+                     'previous': None},
+            'molecules': [payload(i * limit + j) for j in range(limit)]}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _LegacyPipeline(object):
+    # values as MongoDBCache stored them before the serializer pipeline: base64 text of a zlib stream at the old
+    # default COMPRESSION_LEVEL of 0, i.e. not compressed at all
+
+    def dumps(self, value):
+        return _encodebytes(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 0))
+
+    def loads(self, data):
+        return pickle.loads(zlib.decompress(base64.b64decode(data)))
+
+
+_encodebytes = getattr(base64, 'encodebytes', None) or base64.encodestring
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class _CountingCollection(object):
+    # counts the collection methods called, each of them costs at least one round trip to Mongo
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            return attribute(*args, **kwargs)
+        return call
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = 'Measures the throughput of the cache and database backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('async', 'hashed-keys', 'round-trips', 'rows', 'serializers'))
+        parser.add_argument('--cache', default='default', help='Cache alias whose OPTIONS are used '
+                                                               '(default: default)')
+        parser.add_argument('--location', default='cache_benchmark', help='Collection written to by the benchmark, '
+                                                                          'cleared at the end '
+                                                                          '(default: cache_benchmark)')
+        parser.add_argument('--mock', action='store_true', help='Use the in-memory stand-in for Mongo; the numbers '
+                                                                'then only measure the Python side')
+        parser.add_argument('--keys', type=int, default=10000, help='Keys written before measuring '
+                                                                    '(default: 10000)')
+        parser.add_argument('--batch-size', type=int, default=100, help='Keys per multi-key call (default: 100)')
+        parser.add_argument('--calls', type=int, default=1000, help='Measured calls, keys for round-trips '
+                                                                    '(default: 1000)')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent calls (default: 32)')
+        parser.add_argument('--rows', type=int, default=200000, help='Rows converted per measurement '
+                                                                     '(default: 200000)')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, *args, **options):
+        self.options = options
+        getattr(self, 'benchmark_' + options['action'].replace('-', '_'))()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def benchmark_async(self):
+        # concurrent aget_many calls on one event loop against get_many calls on as many threads
+        try:
+            import asyncio
+            from chembl_core_db.cache.backends.asyncMongoDBCache import AsyncMongoDBCache
+        except (ImportError, SyntaxError):
+            raise CommandError('The asyncio API needs Python 3.5+')
+        cache = self._cache(AsyncMongoDBCache)
+        try:
+            keys = self._fill(cache)
+            batches = self._batches(keys)
+            concurrency = self.options['concurrency']
+            pool = ThreadPool(concurrency)
+            try:
+                self._timed('threads, get_many', len(batches), lambda: pool.map(cache.get_many, batches))
+            finally:
+                pool.close()
+                pool.join()
+            loop = asyncio.get_event_loop()
+
+            def run_async():
+                calls = iter(batches)
+                pending = set()
+                while True:
+                    # keeps `concurrency` calls in flight
+                    for batch in calls:
+                        pending.add(asyncio.ensure_future(cache.aget_many(batch)))
+                        if len(pending) == concurrency:
+                            break
+                    if not pending:
+                        return
+                    done, pending = loop.run_until_complete(asyncio.wait(pending,
+                                                                         return_when=asyncio.FIRST_COMPLETED))
+                    for future in done:
+                        future.result()
+
+            self._timed('asyncio, aget_many', len(batches), run_async)
+        finally:
+            cache.clear()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def benchmark_round_trips(self):
+        # round trips and time per batch of the bulk set_many/get_many/delete_many against one call per key, which is
+        # what BaseCache falls back to
+        cache = self._cache(WRITE_BEHIND=False, NEAR_CACHE_MAX_BYTES=0)
+        collection = _CountingCollection(cache._get_collection())
+        cache._get_collection = lambda: collection
+        batch_size = self.options['batch_size']
+        batches = [dict(('/chembl/api/data/molecule/CHEMBL{0}.json'.format(first + i), payload(first + i))
+                        for i in range(batch_size))
+                   for first in range(0, max(self.options['calls'], batch_size), batch_size)]
+        try:
+            for label, call in (('set_many', lambda cache, batch: cache.set_many(batch)),
+                                ('per-key set', lambda cache, batch: BaseCache.set_many(cache, batch)),
+                                ('get_many', lambda cache, batch: cache.get_many(list(batch))),
+                                ('per-key get', lambda cache, batch: BaseCache.get_many(cache, list(batch))),
+                                ('delete_many', lambda cache, batch: cache.delete_many(list(batch))),
+                                ('per-key delete', lambda cache, batch: BaseCache.delete_many(cache, list(batch)))):
+                if 'delete' in label:
+                    # both deletes start from a full collection
+                    for batch in batches:
+                        cache.set_many(batch)
+                collection.calls = 0
+                start = time.time()
+                for batch in batches:
+                    call(cache, batch)
+                elapsed = time.time() - start
+                self.stdout.write('{0:<16} {1:>6} keys per batch {2:>8.1f} round trips per batch {3:>9.2f}ms per '
+                                  'batch'.format(label, batch_size, collection.calls / float(len(batches)),
+                                                 elapsed * 1000 / len(batches)))
+        finally:
+            cache.clear()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def benchmark_serializers(self):
+        # encode and decode throughput and stored size of every serializer and codec available here
+        pipelines = [('pickle+zlib(0)+base64 (before)', _LegacyPipeline())]
+        for serializer_name in sorted(SERIALIZERS):
+            for codec_name in sorted(CODECS):
+                try:
+                    serializer, codec = get_serializer(serializer_name), get_codec(codec_name)
+                except ImproperlyConfigured as e:
+                    self.stderr.write('{0}+{1} skipped: {2}'.format(serializer_name, codec_name, e))
+                    continue
+                label = '{0}+{1}'.format(serializer_name, codec_name)
+                if codec.level is not None:
+                    label += '({0})'.format(codec.level)
+                pipelines.append((label, Pipeline(serializer, codec)))
+        count = self.options['calls']
+        for kind, values in (('molecule', [payload(i) for i in range(count)]),
+                             ('page of 20', [page(i) for i in range(max(count // 20, 1))])):
+            self.stdout.write('{0:<34} {1:>12} {2:>12} {3:>14}'.format(kind, 'encode/s', 'decode/s', 'stored bytes'))
+            for label, pipeline in pipelines:
+                start = time.time()
+                encoded = [pipeline.dumps(value) for value in values]
+                encode = time.time() - start
+                start = time.time()
+                for data in encoded:
+                    pipeline.loads(data)
+                decode = time.time() - start
+                self.stdout.write('{0:<34} {1:>12.0f} {2:>12.0f} {3:>14.0f}'.format(
+                    label, len(values) / encode if encode else 0, len(values) / decode if decode else 0,
+                    sum(len(data) for data in encoded) / float(len(encoded))))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def benchmark_hashed_keys(self):
+        # _id index size and get latency with full URLs as _id against HASH_KEYS; run with a few million --keys
+        count = self.options['keys']
+        batch_size = self.options['batch_size']
+
+        def key(i):
+            return ('/chembl/api/data/activity.json?molecule_chembl_id=CHEMBL{0}&target_chembl_id=CHEMBL{1}'
+                    '&standard_type=IC50&order_by=-pchembl_value&limit=20&offset={2}').format(i, i % 9973, i % 500)
+
+        for label, options in (('full keys (before)', {'HASH_KEYS': False}),
+                               ('HASH_KEYS (after)', {'HASH_KEYS': True})):
+            cache = self._cache(WRITE_BEHIND=False, NEAR_CACHE_MAX_BYTES=0, **options)
+            try:
+                start = time.time()
+                for first in range(0, count, batch_size):
+                    cache.set_many(dict((key(i), i) for i in range(first, min(first + batch_size, count))))
+                self.stdout.write('{0}: {1} keys written in {2:.1f}s'.format(label, count, time.time() - start))
+                if cache._mock:
+                    self.stdout.write('  index sizes are not available with --mock')
+                else:
+                    stats = cache._db.command('collStats', cache._collection)
+                    self.stdout.write('  _id index {0:.1f}MB, all indexes {1:.1f}MB'.format(
+                        stats['indexSizes']['_id_'] / 1048576.0, stats['totalIndexSize'] / 1048576.0))
+                latencies = []
+                for _ in range(self.options['calls']):
+                    i = random.randrange(count)
+                    start = time.time()
+                    if cache.get(key(i)) != i:
+                        raise CommandError('Wrong value read back for key {0}'.format(key(i)))
+                    latencies.append(time.time() - start)
+                latencies.sort()
+                self.stdout.write('  get: mean {0:.3f}ms, p50 {1:.3f}ms, p99 {2:.3f}ms'.format(
+                    sum(latencies) * 1000 / len(latencies), latencies[len(latencies) // 2] * 1000,
+                    latencies[int(len(latencies) * 0.99)] * 1000))
+            finally:
+                cache.clear()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def benchmark_rows(self):
+        # rows per second turned into Python values by the oracleChEmbl backend, for synthetic activity rows
+        try:
+            from chembl_core_db.db.backends.oracleChEmbl import base
+        except (ImportError, ImproperlyConfigured, SyntaxError) as e:
+            raise CommandError('The oracleChEmbl backend does not load: {0}'.format(e))
+        Database = base.Database
+        # (name, type, display_size, internal_size, precision, scale, null_ok)
+        description = [
+            ('ACTIVITY_ID', Database.NUMBER, 12, 22, 11, 0, 0),
+            ('MOLREGNO', Database.NUMBER, 10, 22, 9, 0, 1),
+            ('STANDARD_VALUE', Database.NUMBER, 127, 22, 0, -127, 1),
+            ('PCHEMBL_VALUE', Database.NUMBER, 6, 22, 4, 2, 1),
+            ('RATIO', Database.NUMBER, 127, 22, 126, -127, 1),
+            ('STANDARD_TYPE', Database.STRING, 250, 250, 0, 0, 1),
+            ('STANDARD_UNITS', Database.STRING, 100, 100, 0, 0, 1),
+            ('STANDARD_RELATION', Database.FIXED_CHAR, 50, 50, 0, 0, 1),
+            ('UPDATED_ON', Database.TIMESTAMP, 23, 11, 0, 6, 1),
+        ]
+        updated_on = datetime.datetime(2020, 1, 1)
+        strings = [('{0}'.format(i), '{0}'.format(i % 1000), '{0}.5'.format(i % 5000), '{0}.25'.format(i % 9),
+                    '0.{0}'.format(i % 97), 'IC50', 'nM', '=', updated_on) for i in range(self.options['rows'])]
+        natives = [(i, i % 1000, decimal.Decimal(value[2]), decimal.Decimal(value[3]), float(value[4])) + value[5:]
+                   for i, value in enumerate(strings)]
+
+        class Cursor(object):
+            # cx_Oracle builds a new description list on every access
+            @property
+            def description(self):
+                return [tuple(column) for column in description]
+
+        cursor = Cursor()
+        self._timed('per-row conversion (before)', len(strings),
+                    lambda: [_legacy_rowfactory(base, row, cursor) for row in strings], 'rows')
+        for native_numbers, rows in ((False, strings), (True, natives)):
+            convert = base._row_converter(cursor.description, native_numbers)
+            self._timed('converter plan{0}'.format(', native numbers' if native_numbers else ''), len(rows),
+                        lambda: [convert(row) for row in rows], 'rows')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _cache(self, backend=MongoDBCache, **overrides):
+        params = dict(settings.CACHES.get(self.options['cache'], {}))
+        params['OPTIONS'] = dict(params.get('OPTIONS', {}))
+        if self.options['mock']:
+            params['OPTIONS']['MOCK'] = True
+        params['OPTIONS'].update(overrides)
+        cache = backend(self.options['location'], params)
+        cache.clear()
+        return cache
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fill(self, cache):
+        keys = ['/chembl/api/data/molecule/CHEMBL{0}.json'.format(i) for i in range(self.options['keys'])]
+        batch_size = self.options['batch_size']
+        for start in range(0, len(keys), batch_size):
+            cache.set_many(dict((key, payload(start + i)) for i, key in enumerate(keys[start:start + batch_size])))
+        return keys
+
+    def _batches(self, keys):
+        # `calls` batches of keys, cycling over the keys written
+        batch_size = self.options['batch_size']
+        return [[keys[(call * batch_size + i) % len(keys)] for i in range(batch_size)]
+                for call in range(self.options['calls'])]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _timed(self, label, count, run, unit='calls'):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        self.stdout.write('{0:<40} {1:>8} {2} in {3:>7.2f}s {4:>10.0f}/s'.format(label, count, unit, elapsed,
+                                                                               count / elapsed if elapsed else 0))
+
+# ----------------------------------------------------------------------------------------------------------------------
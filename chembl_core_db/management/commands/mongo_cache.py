@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+import gzip
+import sys
+import time
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+try:
+    from bson import decode_file_iter, encode
+except ImportError:
+    # pymongo < 3.9
+    from bson import BSON, decode_file_iter
+    encode = BSON.encode
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.six.moves.urllib.parse import urljoin
+from django.utils.six.moves.urllib.request import urlopen
+from chembl_core_db.cache.backends.MongoDBCache import MongoDBCache
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+# A dump is a sequence of BSON documents, each starting with its own length, like the files written by mongodump.
+# The first one is a header identifying the file.
+DUMP_FORMAT = 'chembl_core_db.cache'
+DUMP_VERSION = 1
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = 'Dumps and restores a MongoDBCache collection, or warms it up by replaying requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('dump', 'restore', 'warm'))
+        parser.add_argument('path', help="Dump file for dump and restore (gzipped if it ends with .gz), file or URL "
+                                         "with one URL or path per line for warm, '-' for stdin/stdout")
+        parser.add_argument('--cache', default='default', help='Cache alias (default: default)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents per cursor batch and per bulk '
+                                                                         'write (default: 1000)')
+        parser.add_argument('--clear', action='store_true', help='Clear the cache before restoring')
+        parser.add_argument('--base-url', default=None, help='Prefix for relative paths in the warm-up list')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel warm-up requests (default: 8)')
+        parser.add_argument('--timeout', type=float, default=60, help='Warm-up request timeout in seconds')
+        parser.add_argument('--progress', type=int, default=10000, help='Report progress every N documents or '
+                                                                        'requests (default: 10000)')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, *args, **options):
+        self.progress = options['progress']
+        if options['action'] == 'warm':
+            return self.warm(options['path'], options['base_url'], options['concurrency'], options['timeout'])
+        cache = caches[options['cache']]
+        if not isinstance(cache, MongoDBCache):
+            raise CommandError("Cache '{0}' is not a MongoDBCache".format(options['cache']))
+        if options['action'] == 'dump':
+            self.dump(cache, options['path'], options['batch_size'])
+        else:
+            self.restore(cache, options['path'], options['batch_size'], options['clear'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def dump(self, cache, path, batch_size):
+        stream = self._open(path, 'wb')
+        try:
+            stream.write(encode({'format': DUMP_FORMAT, 'version': DUMP_VERSION, 'collection': cache.location,
+                                 'created': datetime.utcnow()}))
+            written = 0
+            for document in self._report('dumped', cache.iter_documents(batch_size), 'documents'):
+                data = encode(document)
+                stream.write(data)
+                written += len(data)
+        finally:
+            if path != '-':
+                stream.close()
+        self.stderr.write('{0} bytes written'.format(written))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def restore(self, cache, path, batch_size, clear):
+        stream = self._open(path, 'rb')
+        try:
+            documents = decode_file_iter(stream)
+            header = next(documents, None)
+            if not header or header.get('format') != DUMP_FORMAT:
+                raise CommandError('{0} is not a cache dump'.format(path))
+            if header.get('version') != DUMP_VERSION:
+                raise CommandError('Unsupported cache dump version {0}'.format(header.get('version')))
+            if clear:
+                cache.clear()
+            cache.restore_documents(self._report('restored', documents, 'documents'), batch_size)
+        finally:
+            if path != '-':
+                stream.close()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def warm(self, path, base_url, concurrency, timeout):
+        if path.startswith(('http://', 'https://')):
+            lines = urlopen(path, timeout=timeout)
+        else:
+            lines = self._open(path, 'rb')
+        urls = (self._url(line, base_url) for line in lines)
+        pool = ThreadPool(concurrency)
+        failed = 0
+        try:
+            results = pool.imap_unordered(lambda url: self._request(url, timeout), (url for url in urls if url))
+            for ok in self._report('requested', results, 'URLs'):
+                failed += not ok
+        finally:
+            pool.close()
+            pool.join()
+            if path != '-':
+                lines.close()
+        if failed:
+            self.stderr.write('{0} requests failed'.format(failed))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _url(self, line, base_url):
+        line = line.strip()
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line or line.startswith('#'):
+            return None
+        if base_url and not line.startswith(('http://', 'https://')):
+            return urljoin(base_url, line)
+        return line
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _request(self, url, timeout):
+        try:
+            response = urlopen(url, timeout=timeout)
+            response.read()
+            response.close()
+            return True
+        except Exception as e:
+            self.stderr.write('{0}: {1}'.format(url, e))
+            return False
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _report(self, verb, items, noun):
+        # passes items through, reporting count and throughput every `progress` items and at the end
+        start = time.time()
+        count = 0
+        for item in items:
+            yield item
+            count += 1
+            if self.progress and count % self.progress == 0:
+                self._status(verb, count, noun, start)
+        self._status(verb, count, noun, start)
+
+    def _status(self, verb, count, noun, start):
+        elapsed = time.time() - start
+        self.stderr.write('{0} {1} {2} in {3:.1f}s ({4:.0f}/s)'.format(verb, count, noun, elapsed,
+                                                                      count / elapsed if elapsed else 0))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _open(self, path, mode):
+        if path == '-':
+            stream = sys.stdout if 'w' in mode else sys.stdin
+            return getattr(stream, 'buffer', stream)
+        if path.endswith('.gz'):
+            return gzip.open(path, mode)
+        return open(path, mode)
+
+# ----------------------------------------------------------------------------------------------------------------------
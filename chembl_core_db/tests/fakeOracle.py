@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+__author__ = 'mnowotka'
+
+# Stand-in for the cx_Oracle module, just enough for the oracleChEmbl backend to connect, execute and fetch without an
+# Oracle client. Every executed statement is recorded on its connection.
+
+import datetime
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+version = '7.0.0'
+apilevel = '2.0'
+threadsafety = 2
+paramstyle = 'named'
+
+
+class _Type(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+NUMBER = _Type('NUMBER')
+NATIVE_FLOAT = _Type('NATIVE_FLOAT')
+STRING = _Type('STRING')
+FIXED_CHAR = _Type('FIXED_CHAR')
+NCHAR = _Type('NCHAR')
+FIXED_NCHAR = _Type('FIXED_NCHAR')
+LONG_STRING = _Type('LONG_STRING')
+TIMESTAMP = _Type('TIMESTAMP')
+DATETIME = _Type('DATETIME')
+CLOB = _Type('CLOB')
+NCLOB = _Type('NCLOB')
+BLOB = _Type('BLOB')
+LOB = _Type('LOB')
+
+
+class Binary(bytes):
+    pass
+
+Timestamp = datetime.datetime
+
+SPOOL_ATTRVAL_WAIT = 0
+SPOOL_ATTRVAL_NOWAIT = 1
+SPOOL_ATTRVAL_FORCEGET = 2
+ATTR_PURITY_DEFAULT = 0
+ATTR_PURITY_NEW = 1
+ATTR_PURITY_SELF = 2
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Warning(Exception):
+    pass
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class NotSupportedError(DatabaseError):
+    pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def makedsn(host, port, service_name):
+    return '{0}:{1}/{2}'.format(host, port, service_name)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Var(object):
+
+    def __init__(self, type, size=0, arraysize=1, outconverter=None):
+        self.type = type
+        self.size = size
+        self.arraysize = arraysize
+        self.outconverter = outconverter
+
+    def convert(self, value):
+        if self.outconverter is not None:
+            return self.outconverter(str(value))
+        if self.type is int:
+            return int(value)
+        if self.type is NATIVE_FLOAT:
+            return float(value)
+        return value
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Cursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 1
+        self.prefetchrows = 2
+        self.numbersAsStrings = False
+        self.outputtypehandler = None
+        self.description = None
+        self._rows = []
+
+    def var(self, type, size=0, arraysize=1, outconverter=None, **kwargs):
+        return Var(type, size, arraysize, outconverter)
+
+    def setinputsizes(self, *args, **kwargs):
+        pass
+
+    def execute(self, statement, parameters=None):
+        self.connection.statements.append(statement)
+        self.connection.fetch_sizes.append((self.arraysize, self.prefetchrows))
+        if self.connection.fail_on and self.connection.fail_on in statement:
+            raise DatabaseError('ORA-01722: invalid number')
+        self.description, self._rows = self.connection.results.pop(statement, (None, []))
+        if self.description:
+            self._rows = [self._convert(row) for row in self._rows]
+
+    def executemany(self, statement, parameters):
+        self.connection.statements.append(statement)
+
+    def _convert(self, row):
+        # NUMBER values are returned as the output type handler asked, or as strings with numbersAsStrings
+        out = []
+        for value, desc in zip(row, self.description):
+            if value is not None and desc[1] is NUMBER:
+                var = self.outputtypehandler(self, desc[0], desc[1], desc[2], desc[4], desc[5]) \
+                    if self.outputtypehandler else None
+                if var is not None:
+                    value = var.convert(value)
+                elif self.numbersAsStrings:
+                    value = str(value)
+            out.append(value)
+        return tuple(out)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.pop(0)
+
+    def close(self):
+        pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Connection(object):
+    # statements containing `fail_on` raise DatabaseError, like the LIKE probe on databases needing LIKEC
+    fail_on = None
+
+    def __init__(self, dsn=None, **kwargs):
+        self.dsn = dsn
+        self.kwargs = kwargs
+        self.statements = []
+        # (arraysize, prefetchrows) of every execution, fetch buffers are allocated there
+        self.fetch_sizes = []
+        # statement -> (description, rows) returned by its next execution
+        self.results = {}
+        self.autocommit = False
+        self.stmtcachesize = 0
+        self.version = '12.1.0.2.0'
+        self.tag = None
+        self.pool = None
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+
+
+def connect(dsn=None, **kwargs):
+    return Connection(dsn, **kwargs)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class SessionPool(object):
+
+    def __init__(self, user, password, dsn, min=1, max=2, increment=1, sessionCallback=None, **kwargs):
+        self.user = user
+        self.dsn = dsn
+        self.min = min
+        self.max = max
+        self.increment = increment
+        self.session_callback = sessionCallback
+        self.kwargs = kwargs
+        self.timeout = 0
+        self.opened = 0
+        self.busy = 0
+        self._idle = []
+
+    def acquire(self, cclass=None, purity=None, tag=None):
+        if self._idle:
+            connection = self._idle.pop()
+        else:
+            connection = Connection(self.dsn, **self.kwargs)
+            self.opened += 1
+        if self.session_callback is not None and tag is not None and connection.tag != tag:
+            self.session_callback(connection, tag)
+        connection.pool = self
+        self.busy += 1
+        return connection
+
+    def release(self, connection):
+        connection.pool = None
+        self.busy -= 1
+        self._idle.append(connection)
+
+# ----------------------------------------------------------------------------------------------------------------------
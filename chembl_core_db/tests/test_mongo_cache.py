@@ -0,0 +1,369 @@
+"""
+Tests of MongoDBCache against the in-memory stand-in for Mongo (the MOCK option, requires mongomock).
+"""
+
+import os
+import time
+import unittest
+
+from django.test import SimpleTestCase
+
+try:
+    import mongomock
+    from chembl_core_db.cache.backends.MongoDBCache import MAX_SIZE, CacheUnavailable, MongoDBCache
+    from chembl_core_db.cache.backends.hashedKeys import HashedKey
+except ImportError:
+    mongomock = None
+try:
+    import asyncio
+    from unittest import mock
+    from chembl_core_db.cache.backends import clientRegistry
+    from chembl_core_db.cache.backends.asyncMongoDBCache import AsyncMongoDBCache
+except (ImportError, SyntaxError):
+    # the asyncio API is Python 3.5+ only
+    AsyncMongoDBCache = None
+try:
+    import motor
+    from pymongo import ReadPreference
+except ImportError:
+    motor = None
+
+
+@unittest.skipIf(mongomock is None, 'the MOCK option needs mongomock')
+class MockCacheTestCase(SimpleTestCase):
+    location = 'mongo_cache_test'
+    backend = MongoDBCache if mongomock else None
+    options = {}
+
+    def setUp(self):
+        options = {'MOCK': True}
+        options.update(self.options)
+        self.cache = self.backend(self.location, {'OPTIONS': options})
+        self.cache.clear()
+        self.calls = []
+
+    def count_calls(self):
+        # records the collection methods called, each of them is one round trip to Mongo
+        coll = self.cache._get_collection()
+        calls = self.calls
+
+        class Counting(object):
+            def __getattr__(self, name):
+                calls.append(name)
+                return getattr(coll, name)
+
+        self.cache._get_collection = Counting
+
+
+class IncrManyTest(MockCacheTestCase):
+
+    def test_creates_and_increments_counters(self):
+        self.cache.set('existing', 10)
+        self.assertEqual(self.cache.incr_many(['new', 'existing']), {'new': 1, 'existing': 11})
+        self.assertEqual(self.cache.incr_many({'new': 5}), {'new': 6})
+        self.assertIsNone(self.cache.incr_many({'new': 1, 'existing': -1}, return_values=False))
+        self.assertEqual(self.cache.get_many(['new', 'existing']), {'new': 7, 'existing': 10})
+
+    def test_round_trips_do_not_depend_on_the_number_of_counters(self):
+        self.count_calls()
+        self.assertEqual(self.cache.incr_many(['a', 'b', 'c']), {'a': 1, 'b': 1, 'c': 1})
+        self.assertEqual(self.calls, ['bulk_write', 'find'])
+        del self.calls[:]
+        self.cache.incr_many(['a', 'b', 'c'], return_values=False)
+        self.assertEqual(self.calls, ['bulk_write'])
+
+    def test_new_counters_are_stored_like_set_numbers(self):
+        self.cache.set('set', 1)
+        self.cache.incr_many(['created'])
+        coll = self.cache._get_collection()
+        stored = [coll.find_one({'_id': self.cache.make_key(key)}) for key in ('set', 'created')]
+        self.assertEqual([(document['resource_name'], document['size']) for document in stored], [('int', 8)] * 2)
+        self.assertEqual(self.cache.stats_by_resource()['int']['count'], 2)
+
+    def test_skips_keys_that_are_not_counters(self):
+        self.cache.set('text', 'aspirin')
+        self.assertEqual(self.cache.incr_many(['text', 'counter']), {'counter': 1})
+        self.cache.incr_many(['text', 'counter'], return_values=False)
+        self.assertEqual(self.cache.get_many(['text', 'counter']), {'text': 'aspirin', 'counter': 2})
+
+    def test_restarts_expired_counters(self):
+        self.cache.incr_many(['short', 'other'], timeout=0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.cache.incr_many({'short': 3}), {'short': 3})
+        self.cache.incr_many({'other': 3}, return_values=False)
+        self.assertEqual(self.cache.get('other'), 3)
+
+
+class BatchRoundTripsTest(MockCacheTestCase):
+
+    def test_batches_cost_a_fixed_number_of_round_trips(self):
+        data = dict(('/chembl/api/data/molecule/CHEMBL{0}'.format(i), {'molregno': i}) for i in range(200))
+        self.count_calls()
+        self.assertEqual(self.cache.set_many(data), [])
+        self.assertEqual(self.calls, ['bulk_write'])
+        del self.calls[:]
+        self.assertEqual(self.cache.get_many(list(data)), data)
+        self.assertEqual(self.calls, ['find'])
+        del self.calls[:]
+        self.cache.delete_many(list(data))
+        # entries and their chunks
+        self.assertEqual(self.calls, ['delete_many', 'delete_many'])
+        self.assertEqual(self.cache.get_many(list(data)), {})
+
+    def test_set_many_reports_failed_keys(self):
+        # resource policies are shared by the whole process, so they get a cache of their own
+        self.cache = MongoDBCache('mongo_cache_policies_test', {'OPTIONS': {'MOCK': True, 'RESOURCE_POLICIES': {
+            'molecule': {'MAX_ENTRY_SIZE': 64}}}})
+        large = {'resource_name': 'molecule', 'canonical_smiles': 'C' * 1000}
+        self.assertEqual(self.cache.set_many({'small': 1, 'large': large}), ['large'])
+        self.assertEqual(self.cache.get_many(['small', 'large']), {'small': 1})
+
+
+class SyncApiTest(MockCacheTestCase):
+
+    def test_round_trip(self):
+        self.cache.set('molecule', {'chembl_id': 'CHEMBL25'})
+        self.cache.set('count', 3)
+        self.assertEqual(self.cache.get('molecule'), {'chembl_id': 'CHEMBL25'})
+        self.assertEqual(self.cache.get_many(['molecule', 'count', 'missing']),
+                         {'molecule': {'chembl_id': 'CHEMBL25'}, 'count': 3})
+        self.assertEqual(self.cache.incr('count'), 4)
+        self.assertFalse(self.cache.add('count', 0))
+        self.assertTrue(self.cache.add('other', 0))
+        self.cache.delete('molecule')
+        self.assertIsNone(self.cache.get('molecule'))
+        self.assertEqual(self.cache.get('molecule', 'default'), 'default')
+
+    def test_expiry(self):
+        self.cache.set('short', 'value', 0.05)
+        self.assertEqual(self.cache.get('short'), 'value')
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertTrue(self.cache.add('short', 'again'))
+
+    def test_large_values_are_chunked(self):
+        value = 'x' * (3 * 1024 * 1024)
+        self.cache.set('large', value)
+        self.assertEqual(self.cache.get('large'), value)
+        self.assertEqual(self.cache.get_many(['large']), {'large': value})
+
+
+class LeaseTest(MockCacheTestCase):
+
+    def test_leases_are_not_chunks(self):
+        coll = self.cache._get_collection()
+        key = self.cache.make_key('report')
+        token = self.cache._acquire_lease(coll, key)
+        self.assertIsNotNone(token)
+        # every way of dropping the chunks of the key
+        self.cache.set('report', os.urandom(MAX_SIZE + 1))
+        self.cache.set('report', 'small')
+        self.cache.set_many({'report': 'small'})
+        self.cache.delete('report')
+        self.assertIsNone(self.cache._acquire_lease(coll, key))
+        # and not an entry either
+        self.assertEqual(self.cache.list_keys(), [])
+        self.cache._release_lease(coll, key, token)
+        self.assertIsNotNone(self.cache._acquire_lease(coll, key))
+
+
+class HashedKeysTest(MockCacheTestCase):
+    options = {'HASH_KEYS': True}
+
+    def test_hash_collisions_are_told_apart(self):
+        # every key gets the same digest
+        self.cache.make_key = lambda key, version=None: HashedKey('digest', key)
+        self.cache.set('k2', 'value')
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertFalse(self.cache.has_key('k1'))
+        self.cache.delete('k1')
+        self.cache.delete_many(['k1'])
+        self.assertEqual(self.cache.get('k2'), 'value')
+        self.cache.delete('k2')
+        self.assertIsNone(self.cache.get('k2'))
+
+
+class HashedKeysWriteBehindTest(HashedKeysTest):
+    options = {'HASH_KEYS': True, 'WRITE_BEHIND': True, 'WRITE_BEHIND_INTERVAL': 60}
+
+
+class CircuitBreakerTest(MockCacheTestCase):
+    # the breaker is shared by the whole process, so it gets a cache of its own
+    location = 'mongo_cache_breaker_test'
+    options = {'CIRCUIT_BREAKER': True, 'CIRCUIT_RESET_TIMEOUT': 60, 'LATENCY_BUDGET_MS': 300}
+
+    def tearDown(self):
+        self.cache.breaker._set_state('closed')
+
+    def test_open_breaker_fails_fast(self):
+        self.cache.set('count', 1)
+        self.cache.breaker._open(time.time())
+        self.count_calls()
+        self.assertIsNone(self.cache.get('count'))
+        self.assertFalse(self.cache.add('other', 1))
+        # calls without a fallback result raise instead
+        self.assertRaises(CacheUnavailable, self.cache.incr, 'count')
+        self.assertRaises(CacheUnavailable, self.cache.delete_by, 'molecule')
+        self.assertRaises(CacheUnavailable, self.cache.stats_by_resource)
+        self.assertRaises(CacheUnavailable, self.cache.clear)
+        self.assertEqual(self.calls, [])
+
+    def test_driver_timeouts_are_capped_by_the_budget(self):
+        kwargs = self.cache._client_kwargs()
+        self.assertEqual((kwargs['serverSelectionTimeoutMS'], kwargs['connecttimeoutms']), (300, 300))
+
+
+class WriteBehindTest(MockCacheTestCase):
+    options = {'WRITE_BEHIND': True, 'WRITE_BEHIND_INTERVAL': 60}
+
+    def test_pending_writes_are_read_back(self):
+        self.cache.set('buffered', 'value')
+        self.assertEqual(self.cache.get('buffered'), 'value')
+        self.assertFalse(self.cache.add('buffered', 'other'))
+        self.cache.delete('buffered')
+        self.assertIsNone(self.cache.get('buffered'))
+
+    def test_add_is_written_through(self):
+        self.cache.set('lock', 'owner1')
+        self.cache.flush()
+        self.assertFalse(self.cache.add('lock', 'owner2'))
+        self.assertEqual(self.cache.get('lock'), 'owner1')
+        self.cache.set('expired', 'old', 0.05)
+        self.cache.flush()
+        time.sleep(0.1)
+        self.assertTrue(self.cache.add('expired', 'new'))
+        self.cache.flush()
+        self.assertEqual(self.cache.get_many(['lock', 'expired']), {'lock': 'owner1', 'expired': 'new'})
+
+    def test_has_key_sees_pending_writes(self):
+        self.cache.set('buffered', 'value')
+        self.assertTrue(self.cache.has_key('buffered'))
+        self.cache.delete('buffered')
+        self.assertFalse(self.cache.has_key('buffered'))
+
+    def test_chunked_values_replace_pending_writes(self):
+        # incompressible, so it is stored in chunks
+        value = os.urandom(MAX_SIZE + 1)
+        self.cache.set('large', 'small')
+        self.cache.set('large', value)
+        self.assertEqual(self.cache.get('large'), value)
+        self.cache.set_many({'many': 'small'})
+        self.cache.set_many({'many': value})
+        self.cache.flush()
+        self.assertEqual(self.cache.get_many(['large', 'many']), {'large': value, 'many': value})
+
+
+@unittest.skipIf(AsyncMongoDBCache is None, 'the asyncio API needs Python 3.5+')
+class AsyncApiTest(MockCacheTestCase):
+    backend = AsyncMongoDBCache
+
+    def run_async(self, coroutine):
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    def test_round_trip(self):
+        self.run_async(self.cache.aset('molecule', {'chembl_id': 'CHEMBL25'}))
+        self.assertEqual(self.run_async(self.cache.aget('molecule')), {'chembl_id': 'CHEMBL25'})
+        self.assertEqual(self.run_async(self.cache.aget('missing', 'default')), 'default')
+        self.run_async(self.cache.adelete('molecule'))
+        self.assertIsNone(self.run_async(self.cache.aget('molecule')))
+
+    def test_deletes_skip_hash_collisions(self):
+        self.cache._hash_keys = True
+        self.cache.make_key = lambda key, version=None: HashedKey('digest', key)
+        self.cache.set('k2', 'value')
+        self.run_async(self.cache.adelete('k1'))
+        self.assertEqual(self.run_async(self.cache.aget('k2')), 'value')
+
+    def test_shares_the_collection_with_the_sync_api(self):
+        value = 'x' * (3 * 1024 * 1024)
+        self.cache.set('sync', 1)
+        self.run_async(self.cache.aset('large', value))
+        self.assertEqual(self.run_async(self.cache.aget_many(['sync', 'large', 'missing'])),
+                         {'sync': 1, 'large': value})
+        self.assertEqual(self.cache.get('large'), value)
+
+
+@unittest.skipIf(AsyncMongoDBCache is None, 'the asyncio API needs Python 3.5+')
+class AsyncWriteBehindTest(AsyncApiTest):
+    options = {'WRITE_BEHIND': True, 'WRITE_BEHIND_INTERVAL': 60}
+
+    def test_pending_writes_are_read_back(self):
+        self.cache.set('buffered', 'value')
+        self.assertEqual(self.run_async(self.cache.aget('buffered')), 'value')
+        self.run_async(self.cache.aset('buffered', 'newer'))
+        self.assertEqual(self.cache.get('buffered'), 'newer')
+        self.assertEqual(self.run_async(self.cache.aget_many(['buffered'])), {'buffered': 'newer'})
+        self.run_async(self.cache.adelete('buffered'))
+        self.assertIsNone(self.cache.get('buffered'))
+
+
+@unittest.skipIf(AsyncMongoDBCache is None, 'the asyncio API needs Python 3.5+')
+class AsyncBreakerAndCullingTest(AsyncApiTest):
+    location = 'mongo_cache_async_breaker_test'
+    options = {'CIRCUIT_BREAKER': True, 'CIRCUIT_RESET_TIMEOUT': 60, 'MAX_ENTRIES': 1000}
+
+    def tearDown(self):
+        self.cache.breaker._set_state('closed')
+
+    def test_open_breaker_skips_mongo(self):
+        self.run_async(self.cache.aset('molecule', 1))
+        self.cache.breaker._open(time.time())
+        self.count_calls()
+        self.cache._async_coll = None
+        self.assertEqual(self.run_async(self.cache.aget('molecule', 'default')), 'default')
+        self.assertEqual(self.run_async(self.cache.aget_many(['molecule'])), {})
+        self.assertIsNone(self.run_async(self.cache.aset('molecule', 2)))
+        self.assertEqual(self.calls, [])
+
+    def test_reads_are_tracked_and_writes_start_culling(self):
+        with mock.patch.object(self.cache, '_maybe_cull') as maybe_cull:
+            self.run_async(self.cache.aset('molecule', 1))
+        self.assertTrue(maybe_cull.called)
+        self.count_calls()
+        self.cache._async_coll = None
+        self.run_async(self.cache.aget('molecule'))
+        self.run_async(self.cache.aget_many(['molecule']))
+        self.assertEqual(self.calls.count('with_options'), 2)
+
+
+@unittest.skipIf(AsyncMongoDBCache is None or motor is None, 'the motor client needs Python 3.5+ and motor')
+class MotorClientTest(SimpleTestCase):
+    # clients are only created, nothing here talks to a server
+
+    def setUp(self):
+        options = {'READ_PREFERENCE': ReadPreference.PRIMARY}
+        self.caches = [AsyncMongoDBCache('motor_client_test', {'OPTIONS': options}) for _ in range(2)]
+        for cache in self.caches:
+            # the synchronous client bootstraps the collection
+            cache._get_collection = lambda: None
+        self.default_loop = asyncio.get_event_loop()
+        self.loops = []
+
+    def tearDown(self):
+        asyncio.set_event_loop(self.default_loop)
+        for loop in self.loops:
+            loop.close()
+
+    def motor_client(self, cache, loop=None):
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self.loops.append(loop)
+        # the loop a coroutine would run on
+        asyncio.set_event_loop(loop)
+        return cache._get_async_collection().database.client, loop
+
+    def test_clients_are_shared_per_loop(self):
+        client, loop = self.motor_client(self.caches[0])
+        self.assertIs(self.motor_client(self.caches[0], loop)[0], client)
+        self.assertIs(self.motor_client(self.caches[1], loop)[0], client)
+        self.assertIsNot(self.motor_client(self.caches[0])[0], client)
+
+    def test_new_loops_and_processes_get_new_clients(self):
+        client, loop = self.motor_client(self.caches[0])
+        loop.close()
+        other, loop = self.motor_client(self.caches[0])
+        self.assertIsNot(other, client)
+        # a forked child; the registry of this process, which holds the MOCK clients of the other tests, is kept
+        with mock.patch('os.getpid', return_value=os.getpid() + 1), \
+                mock.patch.multiple(clientRegistry, _pid=None, _clients={}, _loop_clients={}, _bootstrapped=set()):
+            self.assertIsNot(self.motor_client(self.caches[0], loop)[0], other)
@@ -0,0 +1,235 @@
+"""
+Tests of the oracleChEmbl backend against the fake driver in fakeOracle, so they run without an Oracle client.
+"""
+
+import sys
+import threading
+import unittest
+
+from django.test import SimpleTestCase
+
+from chembl_core_db.tests import fakeOracle
+
+try:
+    import cx_Oracle
+except ImportError:
+    # the backend refuses to load without a driver
+    sys.modules['cx_Oracle'] = fakeOracle
+try:
+    from chembl_core_db.db.backends.oracleChEmbl import base
+except SyntaxError:
+    # the backend is Python 2 only
+    base = None
+
+
+@unittest.skipIf(base is None, 'the oracleChEmbl backend does not load on this Python version')
+class FakeDriverTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.saved = base.Database, base.DatabaseError, base.DatabaseWrapper.Database
+        base.Database = base.DatabaseWrapper.Database = fakeOracle
+        base.DatabaseError = fakeOracle.DatabaseError
+        base._likec_databases.clear()
+        base._session_pools.clear()
+        base._fetch_advisors.clear()
+        fakeOracle.Connection.fail_on = None
+
+    def tearDown(self):
+        base.Database, base.DatabaseError, base.DatabaseWrapper.Database = self.saved
+        base._likec_databases.clear()
+        base._session_pools.clear()
+        base._fetch_advisors.clear()
+        fakeOracle.Connection.fail_on = None
+
+    def wrapper(self, alias='fake', host='db', **options):
+        settings_dict = {
+            'ENGINE': 'chembl_core_db.db.backends.oracleChEmbl', 'NAME': 'chembl', 'USER': 'chembl',
+            'PASSWORD': 'secret', 'HOST': host, 'PORT': '1521', 'OPTIONS': options, 'AUTOCOMMIT': True,
+            'ATOMIC_REQUESTS': False, 'CONN_MAX_AGE': 0, 'TIME_ZONE': None, 'TEST': {},
+        }
+        return base.DatabaseWrapper(settings_dict, alias)
+
+    def statements(self, wrapper):
+        wrapper.connect()
+        statements = list(wrapper.connection.statements)
+        wrapper.close()
+        return statements
+
+
+class SessionInitialisationTest(FakeDriverTestCase):
+
+    def test_session_settings_take_one_statement(self):
+        statements = self.statements(self.wrapper())
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith('BEGIN'))
+        self.assertIn("NLS_TERRITORY = ''AMERICA''", statements[0])
+        self.assertIn('NLS_DATE_FORMAT', statements[0])
+        self.assertIn('LIKE', statements[1])
+
+    def test_like_probe_runs_once_per_database(self):
+        wrapper = self.wrapper()
+        self.assertEqual(len(self.statements(wrapper)), 2)
+        # later connections of the same wrapper, of another wrapper and of another thread
+        self.assertEqual(len(self.statements(wrapper)), 1)
+        self.assertEqual(len(self.statements(self.wrapper())), 1)
+        self.assertEqual(len(self.statements(self.wrapper(alias='other'))), 1)
+        counts = []
+        thread = threading.Thread(target=lambda: counts.append(len(self.statements(self.wrapper()))))
+        thread.start()
+        thread.join()
+        self.assertEqual(counts, [1])
+        # another database is probed on its own
+        self.assertEqual(len(self.statements(self.wrapper(host='other-db'))), 2)
+
+    def test_likec_fallback_is_cached(self):
+        fakeOracle.Connection.fail_on = 'LIKE TRANSLATE'
+        wrapper = self.wrapper()
+        self.assertEqual(len(self.statements(wrapper)), 2)
+        self.assertEqual(wrapper.operators, base.DatabaseWrapper._likec_operators)
+        wrapper = self.wrapper()
+        self.assertEqual(len(self.statements(wrapper)), 1)
+        self.assertEqual(wrapper.operators, base.DatabaseWrapper._likec_operators)
+        self.assertEqual(wrapper.pattern_ops, base.DatabaseWrapper._likec_pattern_ops)
+
+
+class NativeNumbersTest(FakeDriverTestCase):
+    # (name, type, display_size, internal_size, precision, scale, null_ok) of NUMBER(11), FLOAT, NUMBER(10,2),
+    # an unconstrained NUMBER and a string column
+    description = [
+        ('ID', fakeOracle.NUMBER, 12, 22, 11, 0, 0),
+        ('RATIO', fakeOracle.NUMBER, 127, 22, 126, -127, 1),
+        ('PRICE', fakeOracle.NUMBER, 12, 22, 10, 2, 1),
+        ('TOTAL', fakeOracle.NUMBER, 127, 22, 0, -127, 1),
+        ('NAME', fakeOracle.STRING, 10, 10, 0, 0, 1),
+    ]
+    rows = [(1, 0.5, '1.50', 7, 'aspirin'), (2, 2.25, '3.00', '0.125', None)]
+
+    def handler(self, desc):
+        cursor = fakeOracle.Cursor(fakeOracle.Connection())
+        cursor.arraysize = 50
+        return base._output_type_handler(cursor, desc[0], desc[1], desc[3], desc[4], desc[5])
+
+    def test_output_type_handler(self):
+        integer, ratio, price, total, name = [self.handler(desc) for desc in self.description]
+        self.assertIs(integer.type, int)
+        self.assertIs(ratio.type, fakeOracle.NATIVE_FLOAT)
+        self.assertEqual(price.outconverter('1.50'), base.decimal.Decimal('1.50'))
+        self.assertIsInstance(total.outconverter('7'), int)
+        self.assertEqual(total.outconverter('7'), 7)
+        self.assertEqual(total.outconverter('0.125'), base.decimal.Decimal('0.125'))
+        self.assertIsNone(name)
+        self.assertEqual(integer.arraysize, 50)
+
+    def test_row_converter_skips_numbers(self):
+        numbers = self.description[:4]
+        self.assertIs(base._row_converter(numbers, native_numbers=True), tuple)
+        self.assertIsNot(base._row_converter(numbers), tuple)
+        # only the string column is left to convert, numbers pass through untouched
+        convert = base._row_converter(self.description, native_numbers=True)
+        self.assertEqual(convert(('1', '2', '3', '4', 'x')), ('1', '2', '3', '4', 'x'))
+
+    def fetch(self, native_numbers):
+        wrapper = self.wrapper(native_numbers=native_numbers)
+        wrapper.connect()
+        query = 'SELECT ID, RATIO, PRICE, TOTAL, NAME FROM T'
+        wrapper.connection.results[query] = (self.description, self.rows)
+        cursor = wrapper.create_cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        wrapper.close()
+        return rows
+
+    def test_native_numbers_fetch_the_same_values(self):
+        Decimal = base.decimal.Decimal
+        rows = self.fetch(native_numbers=True)
+        self.assertEqual(rows, ((1, 0.5, Decimal('1.50'), 7, 'aspirin'), (2, 2.25, Decimal('3.00'),
+                                                                           Decimal('0.125'), None)))
+        self.assertEqual([[type(value) for value in row] for row in rows],
+                         [[type(value) for value in row] for row in self.fetch(native_numbers=False)])
+
+
+class SessionPoolTest(FakeDriverTestCase):
+
+    def test_pool_gets_connection_params(self):
+        wrapper = self.wrapper(pool={'min': 2, 'max': 8}, threaded=False, encoding='UTF-8', nencoding='UTF-8',
+                               events=True, native_numbers=True)
+        wrapper.connect()
+        pool = base._session_pools['fake'].pool
+        self.assertEqual(pool.kwargs, {'threaded': False, 'encoding': 'UTF-8', 'nencoding': 'UTF-8', 'events': True,
+                                       'getmode': fakeOracle.SPOOL_ATTRVAL_WAIT})
+        self.assertEqual((pool.min, pool.max), (2, 8))
+        self.assertEqual(wrapper.connection.kwargs['encoding'], 'UTF-8')
+        wrapper.close()
+
+    def test_pool_is_threaded_by_default(self):
+        wrapper = self.wrapper(pool={})
+        wrapper.connect()
+        self.assertIs(base._session_pools['fake'].pool.kwargs['threaded'], True)
+        wrapper.close()
+
+    def test_pool_stats_do_not_open_the_pool(self):
+        wrapper = self.wrapper(pool={})
+        self.assertIsNone(wrapper.pool_stats())
+        self.assertNotIn('fake', base._session_pools)
+        wrapper.connect()
+        self.assertEqual(wrapper.pool_stats()['busy'], 1)
+        wrapper.close()
+        self.assertEqual(wrapper.pool_stats()['busy'], 0)
+        self.assertIsNone(self.wrapper().pool_stats())
+
+    def test_sessions_are_initialised_once(self):
+        wrapper = self.wrapper(pool={})
+        statements = self.statements(wrapper)
+        self.assertEqual(len(statements), 2)
+        # the session comes back from the pool without new statements
+        self.assertEqual(self.statements(wrapper), statements)
+        stats = wrapper.pool_stats()
+        self.assertEqual((stats['opened'], stats['acquired'], stats['sessions_initialised']), (1, 2, 1))
+
+
+class FetchSizeTest(FakeDriverTestCase):
+    query = 'SELECT ID FROM T'
+
+    def fetch(self, wrapper, rows):
+        wrapper.connection.results[self.query] = ([('ID', fakeOracle.NUMBER, 12, 22, 11, 0, 0)],
+                                                  [(i,) for i in range(rows)])
+        cursor = wrapper.create_cursor()
+        cursor.execute(self.query)
+        self.assertEqual(len(list(cursor)), rows)
+        arraysize = cursor.cursor.arraysize
+        cursor.close()
+        return arraysize
+
+    def test_fetch_size_overrides_the_configured_sizes(self):
+        wrapper = self.wrapper(arraysize=50)
+        wrapper.connect()
+        # the session setup runs statements of its own
+        before = wrapper.fetch_stats()
+        self.fetch(wrapper, 10)
+        with wrapper.fetch_size(5000, prefetchrows=5001):
+            self.fetch(wrapper, 10)
+        self.fetch(wrapper, 10)
+        self.assertEqual(wrapper.connection.fetch_sizes[-3:], [(50, 2), (5000, 5001), (50, 2)])
+        # statements run inside the block are counted by the connection's advisor
+        stats = wrapper.fetch_stats()
+        self.assertEqual([stats[name] - before[name] for name in ('statements', 'rows', 'round_trips')], [3, 30, 6])
+        wrapper.close()
+
+    def test_adaptive_sizes_apply_from_the_next_execute(self):
+        wrapper = self.wrapper(arraysize=100, adaptive_arraysize=True, max_arraysize=1000)
+        wrapper.connect()
+        before = wrapper.fetch_stats()
+        # the arraysize a statement was executed with is used for all of its rows
+        self.assertEqual([self.fetch(wrapper, rows) for rows in (5000, 1, 300)], [100, 1000, 100])
+        self.assertEqual([size for size, prefetchrows in wrapper.connection.fetch_sizes[-3:]], [100, 1000, 100])
+        # round trips are estimated with the arraysize of each execution: 1 + 50, 1 + 1 and 1 + 3
+        self.assertEqual(wrapper.fetch_stats()['round_trips'] - before['round_trips'], 57)
+        wrapper.close()
+
+    def test_fixed_sizes_without_adaptive_mode(self):
+        wrapper = self.wrapper(arraysize=100)
+        wrapper.connect()
+        self.assertEqual([self.fetch(wrapper, rows) for rows in (5000, 5000)], [100, 100])
+        self.assertEqual(wrapper.fetch_stats()['learnt_statements'], 0)
+        wrapper.close()
@@ -0,0 +1,56 @@
+"""
+Tests of the serializer and codec pipeline of MongoDBCache.
+"""
+
+import base64
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from chembl_core_db.cache.backends.serializers import CODECS, SERIALIZERS, Pipeline, get_codec, get_serializer
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+VALUE = {'molecule_chembl_id': 'CHEMBL25', 'max_phase': 4, 'pref_name': None,
+         'molecule_synonyms': [{'synonyms': 'ASPIRIN', 'syn_type': 'TRADE_NAME'}] * 50}
+
+
+class PipelineTest(SimpleTestCase):
+
+    def pipelines(self):
+        for serializer_name in sorted(SERIALIZERS):
+            for codec_name in sorted(CODECS):
+                try:
+                    yield Pipeline(get_serializer(serializer_name), get_codec(codec_name))
+                except ImproperlyConfigured:
+                    # optional module not installed
+                    pass
+
+    def test_round_trip(self):
+        for pipeline in self.pipelines():
+            data = pipeline.dumps(VALUE)
+            self.assertTrue(pipeline.is_payload(data))
+            self.assertEqual(pipeline.loads(data), VALUE)
+
+    def test_reads_entries_written_with_other_settings(self):
+        reader = Pipeline(get_serializer('pickle'), get_codec('none'))
+        for pipeline in self.pipelines():
+            self.assertEqual(reader.loads(pipeline.dumps(VALUE)), VALUE)
+
+    def test_small_and_incompressible_values_are_stored_as_they_are(self):
+        pipeline = Pipeline(get_serializer('pickle'), get_codec('zlib'), min_size=10000)
+        self.assertFalse(pipeline.encode(VALUE)[2])
+        pipeline = Pipeline(get_serializer('pickle'), get_codec('zlib'), max_ratio=0.01)
+        self.assertFalse(pipeline.encode(VALUE)[2])
+        self.assertEqual(pipeline.loads(pipeline.dumps(VALUE)), VALUE)
+        self.assertTrue(Pipeline(get_serializer('pickle'), get_codec('zlib')).encode(VALUE)[2])
+
+    def test_legacy_entries_are_not_payloads(self):
+        pipeline = Pipeline(get_serializer('pickle'), get_codec('zlib'))
+        for legacy in (pickle.dumps(VALUE, pickle.HIGHEST_PROTOCOL),
+                       base64.b64encode(zlib.compress(pickle.dumps(VALUE, pickle.HIGHEST_PROTOCOL), 0))):
+            self.assertFalse(pipeline.is_payload(legacy))
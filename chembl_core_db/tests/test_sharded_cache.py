@@ -0,0 +1,99 @@
+"""
+Tests of ShardedMongoDBCache over several in-memory stand-in deployments (the MOCK option, requires mongomock).
+"""
+
+import threading
+import unittest
+
+from django.test import SimpleTestCase
+
+from chembl_core_db.cache.backends.hashRing import HashRing
+
+try:
+    import mongomock
+    from chembl_core_db.cache.backends.shardedMongoDBCache import ShardedMongoDBCache
+except ImportError:
+    mongomock = None
+
+KEYS = ['/api/molecule/CHEMBL{0}'.format(i) for i in range(20000)]
+
+
+class HashRingTest(SimpleTestCase):
+
+    def test_keys_are_spread_evenly(self):
+        distribution = HashRing(['a', 'b', 'c', 'd']).distribution(KEYS)
+        self.assertEqual(sorted(distribution), ['a', 'b', 'c', 'd'])
+        for count in distribution.values():
+            self.assertAlmostEqual(count / float(len(KEYS)), 0.25, delta=0.05)
+
+    def test_weights(self):
+        distribution = HashRing({'a': 1, 'b': 3}).distribution(KEYS)
+        self.assertAlmostEqual(distribution['b'] / float(len(KEYS)), 0.75, delta=0.05)
+
+    def test_adding_a_node_moves_its_share_of_keys(self):
+        for nodes in (3, 4, 8):
+            before = HashRing(['node{0}'.format(i) for i in range(nodes)])
+            after = HashRing(['node{0}'.format(i) for i in range(nodes + 1)])
+            moved = before.moved(after, KEYS) / float(len(KEYS))
+            self.assertAlmostEqual(moved, 1.0 / (nodes + 1), delta=0.05)
+            # keys only ever move to the new node
+            self.assertTrue(all(after.get_node(key) in (before.get_node(key), 'node{0}'.format(nodes))
+                                for key in KEYS[:2000]))
+
+
+@unittest.skipIf(mongomock is None, 'the MOCK option needs mongomock')
+class ShardedCacheTest(SimpleTestCase):
+    location = 'sharded_cache_test'
+
+    def setUp(self):
+        # each HOST gets its own in-memory client, standing in for a separate deployment
+        self.cache = ShardedMongoDBCache(self.location, {'OPTIONS': {
+            'MOCK': True, 'READ_PREFERENCE': 'primary',
+            'SHARDS': [{'HOST': 'shard{0}'.format(i)} for i in range(4)]}})
+        self.cache.clear()
+
+    def data(self, count=400):
+        return dict(('key{0}'.format(i), i) for i in range(count))
+
+    def test_multi_key_calls_are_routed_and_merged(self):
+        data = self.data()
+        self.assertEqual(self.cache.set_many(data), [])
+        self.assertEqual(self.cache.get_many(list(data)), data)
+        for key in ('key1', 'key2', 'key3'):
+            self.assertEqual(self.cache.get_shard(key).get(key), data[key])
+        self.cache.delete_many(['key1', 'key2'])
+        self.assertEqual(self.cache.get_many(['key1', 'key2', 'key3']), {'key3': 3})
+
+    def test_keys_are_spread_over_the_shards(self):
+        data = self.data()
+        self.cache.set_many(data)
+        counts = [len(shard.get_many(list(data))) for shard in self.cache.shards.values()]
+        self.assertEqual(sum(counts), len(data))
+        self.assertTrue(all(count > len(data) / 8 for count in counts), counts)
+
+    def test_failing_shard_does_not_fail_the_read(self):
+        data = self.data()
+        self.cache.set_many(data)
+        name, broken = list(self.cache.shards.items())[0]
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('shard down')
+
+        broken.get_many = broken.set_many = fail
+        expected = dict((key, value) for key, value in data.items()
+                        if self.cache.ring.get_node(self.cache.make_key(key)) != name)
+        self.assertEqual(self.cache.get_many(list(data)), expected)
+        self.assertEqual(sorted(self.cache.set_many(data)), sorted(set(data) - set(expected)))
+
+    def test_workers_are_shared_and_persistent(self):
+        data = self.data()
+        self.cache.set_many(data)
+        self.cache.get_many(list(data))
+        threads = threading.active_count()
+        other = ShardedMongoDBCache(self.location, {'OPTIONS': {
+            'MOCK': True, 'READ_PREFERENCE': 'primary',
+            'SHARDS': [{'HOST': 'shard{0}'.format(i)} for i in range(4)]}})
+        self.assertIs(other.workers, self.cache.workers)
+        for _ in range(10):
+            self.assertEqual(other.get_many(list(data)), data)
+        self.assertEqual(threading.active_count(), threads)
@@ -27,7 +27,10 @@ setup(
               'chembl_core_db.db.backends',
               'chembl_core_db.db.backends.oracleChEmbl',
               'chembl_core_db.db.models',
-              'chembl_core_db.testing'],
+              'chembl_core_db.management',
+              'chembl_core_db.management.commands',
+              'chembl_core_db.testing',
+              'chembl_core_db.tests'],
     long_description=open('README.rst').read(),
     install_requires=['Django==1.11'],
     include_package_data=False,